@@ -1,17 +1,69 @@
 """
 REST API for Smart Librarian using FastAPI.
 """
-from fastapi import FastAPI, HTTPException, Request
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.datastructures import MutableHeaders
+from pydantic import BaseModel, Field
+from typing import AsyncIterator, Awaitable, List, Dict, TypeVar
+import asyncio
+import gc
+import hmac
 import os
+import threading
 import json
+import time
 
-from tools import get_summary_by_title
-from smart_librarian import SmartLibrarianService, load_summaries
+import metrics
+from covers import COVER_CACHE_CONTROL, COVER_MAX_SIZE, COVER_MIN_SIZE, COVER_SIZE, parse_size
+from tools import find_book
+from smart_librarian import SUMMARIES_PAGE_SIZE, SmartLibrarianService, load_summaries
 
-app = FastAPI()
+T = TypeVar("T")
+
+# Status used when the client went away before the reply was ready (nginx convention)
+CLIENT_CLOSED_REQUEST = 499
+DISCONNECT_POLL_INTERVAL = 0.25
+# Add a Server-Timing header with per-stage durations to every response (for debugging)
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "").lower() in ("1", "true", "yes")
+# Load the catalog and indexes at import time, before a preloading server (e.g. gunicorn
+# --preload) forks its workers, so they share the pages copy-on-write
+SERVICE_PRELOAD = os.environ.get("SERVICE_PRELOAD", "").lower() in ("1", "true", "yes")
+# How long a request that arrives during warm-up waits before getting a 503
+READY_WAIT = float(os.environ.get("READY_WAIT", "30"))
+# Bearer token required by the catalog maintenance endpoints; unset disables them
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+# Served while the service is still warming up
+LIVENESS_PATHS = frozenset({"/health", "/ready", "/metrics"})
+
+
+# Set on the event loop once warm-up has finished (or failed); requests arriving earlier wait on it
+_startup_event: asyncio.Event | None = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _startup_event
+    loop = asyncio.get_running_loop()
+    _startup_event = asyncio.Event()
+    service.add_ready_callback(lambda: loop.call_soon_threadsafe(_startup_event.set))
+    # Heavy start-up work runs in the background so the worker accepts connections at once
+    threading.Thread(target=_warm_up, name="warm-up", daemon=True).start()
+    yield
+    await service.aclose()
+
+
+def _warm_up() -> None:
+    try:
+        service.warm_up()
+    except Exception:
+        # Recorded in service.warmup_error and reported by /ready
+        pass
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow CORS for development (Expo/mobile/web)
 app.add_middleware(
@@ -20,14 +72,103 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Prompt-Tokens", "X-Prompt-Tokens-Saved"],
 )
 
-service = SmartLibrarianService()
-summaries = service.summaries
+
+class WaitUntilReadyMiddleware:
+    """Answer 503 to requests (other than LIVENESS_PATHS) until warm-up has finished.
+
+    Plain ASGI rather than BaseHTTPMiddleware, which would hide client disconnects from
+    the endpoints (see _cancel_on_disconnect)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not service.ready and scope["path"] not in LIVENESS_PATHS:
+            # Waiting on the loop rather than in a thread keeps a start-up burst off the thread pool
+            if _startup_event is not None and not service.warmup_error:
+                try:
+                    await asyncio.wait_for(_startup_event.wait(), READY_WAIT)
+                except asyncio.TimeoutError:
+                    pass
+            if not service.ready:
+                response = JSONResponse({"detail": "Service is starting"}, status_code=503,
+                                        headers={"Retry-After": "5"})
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class RecordTimingMiddleware:
+    """Observe HTTP latency by route and status and, with SERVER_TIMING, add a Server-Timing header.
+
+    Responses to requests that built a chat prompt also get X-Prompt-Tokens and
+    X-Prompt-Tokens-Saved, the prompt size and the tokens the context builder saved."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        with metrics.track_request() as spans:
+            async def send_with_timing(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    headers = MutableHeaders(scope=message)
+                    if SERVER_TIMING:
+                        headers.append("Server-Timing", metrics.server_timing(spans, time.perf_counter() - started))
+                    # Streamed replies start before their prompt is built; they report it in `done`
+                    prompt = metrics.request_prompt_tokens()
+                    if prompt is not None:
+                        headers.append("X-Prompt-Tokens", str(prompt[0]))
+                        headers.append("X-Prompt-Tokens-Saved", str(prompt[1]))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                # The router stores the matched route in the shared scope
+                route = scope.get("route")
+                metrics.HTTP_SECONDS.observe(
+                    time.perf_counter() - started, scope["method"], getattr(route, "path", "unmatched"), str(status)
+                )
+
+
+# Added last, so it runs first and also times requests held back during warm-up
+app.add_middleware(WaitUntilReadyMiddleware)
+app.add_middleware(RecordTimingMiddleware)
+
+service = SmartLibrarianService(lazy=True)
+if SERVICE_PRELOAD:
+    service.load_indexes()
+    # Keep the collector from touching (and so copying) the preloaded objects in workers
+    gc.freeze()
 
 class QueryRequest(BaseModel):
     query: str
 
+class BatchRecommendRequest(BaseModel):
+    queries: List[str]
+    n: int = Field(3, ge=1, le=50)
+
+class BookRequest(BaseModel):
+    title: str
+    summary: str
+    full_summary: str | None = None
+
+class BookUpdateRequest(BaseModel):
+    title: str | None = None
+    summary: str | None = None
+    full_summary: str | None = None
+
 class CoverRequest(BaseModel):
     title: str | None = None
     prompt: str | None = None
@@ -45,29 +186,147 @@ class ConversationMessageRequest(BaseModel):
 
 MODEL_NAME = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
 
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def _etags(header: str | None) -> List[str]:
+    """Entity tags listed in an If-None-Match header (weak tags compare equal)."""
+    if not header:
+        return []
+    return [tag.strip().removeprefix("W/") for tag in header.split(",")]
+
+
+async def _cancel_on_disconnect(request: Request, awaitable: Awaitable[T]) -> T:
+    """Await `awaitable`, cancelling it if the HTTP client disconnects first."""
+    task = asyncio.ensure_future(awaitable)
+
+    async def watch() -> None:
+        while not task.done():
+            if await request.is_disconnected():
+                task.cancel()
+                return
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+    watcher = asyncio.create_task(watch())
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if watcher.done() and not watcher.cancelled():
+            raise ClientDisconnected()
+        raise
+    finally:
+        watcher.cancel()
+
+
+@app.exception_handler(ClientDisconnected)
+async def client_disconnected_handler(request: Request, exc: ClientDisconnected):
+    return Response(status_code=CLIENT_CLOSED_REQUEST)
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
-@app.get("/summaries", response_model=List[Dict[str, str]])
-def get_all_summaries():
-    return summaries
+@app.get("/ready")
+def ready():
+    """Readiness: 200 once the catalog and indexes are loaded (unlike /health, which is liveness)."""
+    body = {
+        "status": "ready" if service.ready else ("failed" if service.warmup_error else "starting"),
+        "vector_store": service.vector_store_status,
+    }
+    if service.warmup_error:
+        body["error"] = service.warmup_error
+    return JSONResponse(body, status_code=200 if service.ready else 503)
+
+@app.get("/stats")
+def stats():
+    return {
+        "chat_paths": dict(service.chat_path_counts),
+        "retrieval_paths": dict(service.retrieval_counts),
+        "context": dict(service.context_counts),
+        "caches": service.cache_stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/summaries")
+def get_all_summaries(request: Request, cursor: str | None = None, limit: int = Query(SUMMARIES_PAGE_SIZE, ge=1),
+                      fields: str = "title,summary", theme: str | None = None):
+    """Paginated catalog listing; follow `next_cursor` for the next page. Supports If-None-Match."""
+    try:
+        body, etag = service.summaries_page(cursor, limit, fields.split(","), theme)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in _etags(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.get("/summary/{title}")
 def get_summary(title: str):
-    summary = get_summary_by_title(title)
-    if summary.startswith("Rezumat indisponibil"):
+    pos = find_book(title)
+    if pos is None:
         raise HTTPException(status_code=404, detail="Summary not found")
-    return {"title": title, "summary": summary}
+    return {"title": service.catalog.title(pos), "summary": service.catalog.full_summary(pos)}
 
 @app.post("/recommend")
 def recommend_books(request: QueryRequest):
     titles = service.recommend(request.query, n=3)
     return {"recommended_titles": titles}
 
+@app.post("/recommend/batch")
+def recommend_books_batch(request: BatchRecommendRequest):
+    """Recommend for many queries in one call (offline jobs); results follow request order."""
+    results = service.recommend_many(request.queries, n=request.n)
+    return {
+        "results": [
+            {"query": q, "recommended_titles": titles} for q, titles in zip(request.queries, results)
+        ]
+    }
+
+# Catalog maintenance
+def require_admin(authorization: str | None = Header(None)) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin API disabled; set ADMIN_TOKEN to enable it")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+@app.post("/books", status_code=201, dependencies=[Depends(require_admin)])
+def add_book(req: BookRequest):
+    try:
+        return service.add_book(req.title, req.summary, full_summary=req.full_summary)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.put("/books/{title}", dependencies=[Depends(require_admin)])
+def update_book(title: str, req: BookUpdateRequest):
+    try:
+        return service.update_book(title, summary=req.summary, new_title=req.title,
+                                   full_summary=req.full_summary)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Book not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.delete("/books/{title}", status_code=204, dependencies=[Depends(require_admin)])
+def remove_book(title: str):
+    try:
+        service.remove_book(title)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Book not found")
+
+@app.post("/admin/reindex", dependencies=[Depends(require_admin)])
+def reindex():
+    return service.reindex()
+
 @app.post("/responses")
-def responses(req: ResponsesRequest):
-    return service.chat_with_history(req.messages)
+async def responses(req: ResponsesRequest, request: Request):
+    return await _cancel_on_disconnect(request, service.achat_with_history(req.messages))
 
 # Conversations API
 @app.post("/conversations", response_model=CreateConversationResponse)
@@ -80,54 +339,67 @@ def get_conversation(conversation_id: str):
     return {"messages": service.get_conversation(conversation_id)}
 
 @app.post("/conversations/message")
-def post_message(req: ConversationMessageRequest):
+async def post_message(req: ConversationMessageRequest, request: Request):
     try:
-        result = service.add_user_message(req.conversation_id, req.message)
+        result = await _cancel_on_disconnect(request, service.aadd_user_message(req.conversation_id, req.message))
         # Include the conversation_id for clients that wish to store/refresh it
         result["conversation_id"] = req.conversation_id
         return result
     except KeyError:
         # Auto-recover: create a new conversation and handle the message
         new_cid = service.create_conversation()
-        result = service.add_user_message(new_cid, req.message)
+        result = await _cancel_on_disconnect(request, service.aadd_user_message(new_cid, req.message))
         result["conversation_id"] = new_cid
         return result
 
 
+def _sse(event: str, data: Dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/conversations/message/stream")
+async def post_message_stream(req: ConversationMessageRequest):
+    """Server-Sent Events variant of /conversations/message.
+
+    Emits `candidates` (RAG titles) right away, then `token` events as the model
+    writes, then `done` with the full reply (and, since headers are already sent, the
+    prompt token counts other responses carry in X-Prompt-Tokens*). The conversation is
+    only updated once the stream completes; a client disconnect cancels generation.
+    """
+    cid = req.conversation_id
+    if not await asyncio.to_thread(service.conversations.exists, cid):
+        # Auto-recover like the non-streaming endpoint
+        cid = service.create_conversation()
+
+    async def events() -> AsyncIterator[str]:
+        async for event, data in service.astream_user_message(cid, req.message):
+            if event in ("candidates", "done"):
+                data = {**data, "conversation_id": cid}
+            if event == "done":
+                prompt = metrics.request_prompt_tokens()
+                if prompt is not None:
+                    data["prompt_tokens"], data["saved_tokens"] = prompt
+            yield _sse(event, data)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/cover")
 def cover(req: CoverRequest):
-    """Generate or return a placeholder cover image as a data URL.
-    Uses a simple SVG fallback so this works without external keys/services.
-    """
+    """Return a placeholder cover image as a data URL. Prefer GET /cover/{title} for raw SVG."""
     title_or_prompt = (req.title or req.prompt or "Book").strip()
-    try:
-        # For now, return the local placeholder to avoid network dependencies.
-        # A fuller implementation could call a service method that uses OpenAI Images when available.
-        return {"image_data_url": _placeholder_svg_data_url(title_or_prompt)}
-    except Exception:
-        # Last-resort fallback
-        return {"image_data_url": _placeholder_svg_data_url(title_or_prompt)}
-
-
-def _placeholder_svg_data_url(title: str) -> str:
-    import base64
-    safe_title = (title or "Book").replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-    svg = f"""
-    <svg xmlns='http://www.w3.org/2000/svg' width='512' height='512'>
-      <defs>
-        <linearGradient id='g' x1='0' y1='0' x2='1' y2='1'>
-          <stop offset='0%' stop-color='#0b0b0d'/>
-          <stop offset='100%' stop-color='#b91c1c'/>
-        </linearGradient>
-      </defs>
-      <rect width='100%' height='100%' fill='url(#g)' />
-      <rect x='32' y='32' width='448' height='448' rx='16' ry='16' fill='none' stroke='#dc2626' stroke-width='4'/>
-      <text x='50%' y='50%' dominant-baseline='middle' text-anchor='middle' fill='#ffffff' font-size='28' font-family='Arial'>
-        {safe_title}
-      </text>
-    </svg>
-    """.strip()
-    b64 = base64.b64encode(svg.encode("utf-8")).decode("ascii")
-    return f"data:image/svg+xml;base64,{b64}"
+    return {"image_data_url": service.covers.data_url(title_or_prompt, parse_size(req.size))}
 
 
+@app.get("/cover/{title}")
+def cover_svg(title: str, request: Request, size: int = Query(COVER_SIZE, ge=COVER_MIN_SIZE, le=COVER_MAX_SIZE)):
+    """Placeholder cover as `image/svg+xml`, cacheable by clients and proxies."""
+    svg, etag = service.covers.get(title.strip() or "Book", size)
+    headers = {"ETag": etag, "Cache-Control": COVER_CACHE_CONTROL}
+    if etag in _etags(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=svg, media_type="image/svg+xml", headers=headers)
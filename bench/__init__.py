@@ -0,0 +1 @@
+"""Benchmarks, synthetic catalogs and a stub LLM server; see `python -m bench.run --help`."""
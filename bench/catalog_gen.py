@@ -0,0 +1,105 @@
+"""Synthetic catalogs in the `book_summaries.txt` format.
+
+    python -m bench.catalog_gen --count 100000 --out bench/data/catalog_100000.txt
+
+Output is deterministic for a given count and seed, so runs on different machines
+(or commits) score the same documents and queries.
+"""
+
+import argparse
+import os
+import random
+from typing import Iterator, List, Optional, Tuple
+
+THEMES = [
+    "adventure", "friendship", "courage", "love", "war", "magic", "family", "betrayal", "freedom",
+    "survival", "identity", "power", "justice", "loss", "redemption", "ambition", "revenge", "hope",
+    "oppression", "mystery", "coming of age", "sacrifice", "exploration", "memory", "faith", "greed",
+]
+SUBJECTS = [
+    "a young orphan", "an aging detective", "a reluctant king", "two estranged sisters", "a ship's doctor",
+    "a village healer", "a disgraced knight", "a curious scientist", "a wandering musician", "an exiled prince",
+    "a retired soldier", "a street thief", "a lonely astronomer", "a stubborn farmer", "a talented forger",
+]
+PLACES = [
+    "a frozen kingdom", "a crowded harbor city", "a desert empire", "a haunted manor", "a distant planet",
+    "a mountain monastery", "a sunken island", "a border town", "a floating library", "an underground city",
+]
+GOALS = [
+    "uncovers a conspiracy", "searches for a lost sibling", "must stop a rising tyrant", "guards a forbidden book",
+    "races to find a cure", "tries to repay an old debt", "escapes a powerful guild", "solves a string of thefts",
+    "leads a desperate rebellion", "protects a dragon's egg", "maps an uncharted sea", "breaks an ancient curse",
+]
+TWISTS = [
+    "Old loyalties are tested along the way.", "Nothing about the past is what it seemed.",
+    "Every victory costs something precious.", "Unlikely allies become a new family.",
+    "The real enemy is closer than expected.", "A single choice changes the fate of many.",
+]
+TITLE_WORDS = [
+    "Shadow", "River", "Crown", "Ember", "Glass", "Winter", "Silent", "Iron", "Star", "Garden", "Storm",
+    "Hollow", "Golden", "Raven", "Tide", "Ash", "Lantern", "Thorn", "Echo", "Salt", "Wolf", "Paper",
+]
+TITLE_SHAPES = ["The {a} of {b}", "{a} and {b}", "The Last {a}", "A {a} in the {b}", "{a} {b}", "Beyond the {a}"]
+
+
+def _record(rng: random.Random, i: int) -> Tuple[str, str]:
+    shape = rng.choice(TITLE_SHAPES)
+    # The index suffix keeps titles unique at any catalog size
+    title = shape.format(a=rng.choice(TITLE_WORDS), b=rng.choice(TITLE_WORDS)) + f" {i + 1}"
+    themes = rng.sample(THEMES, 3)
+    summary = (
+        f"In {rng.choice(PLACES)}, {rng.choice(SUBJECTS)} {rng.choice(GOALS)}. {rng.choice(TWISTS)}\n"
+        f"Themes: {', '.join(themes)}."
+    )
+    return title, summary
+
+
+def iter_catalog(count: int, seed: int = 0) -> Iterator[Tuple[str, str]]:
+    rng = random.Random(seed)
+    for i in range(count):
+        yield _record(rng, i)
+
+
+def write_catalog(path: str, count: int, seed: int = 0) -> str:
+    """Write a catalog of `count` books to `path` unless an identical one already exists."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(path):
+        return path
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for title, summary in iter_catalog(count, seed):
+            f.write(f"## Title: {title}\n{summary}\n\n")
+    os.replace(tmp, path)
+    return path
+
+
+def catalog_path(directory: str, count: int, seed: int = 0) -> str:
+    return os.path.join(directory, f"catalog_{count}_s{seed}.txt")
+
+
+def sample_queries(count: int, seed: int = 1) -> List[str]:
+    """Natural-language queries over the generator's vocabulary, in the style users type."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        parts = rng.sample(THEMES, 2)
+        queries.append(rng.choice([
+            f"I want a book about {parts[0]} and {parts[1]}",
+            f"something with {rng.choice(SUBJECTS)} in {rng.choice(PLACES)}",
+            f"a story where someone {rng.choice(GOALS)}",
+            f"{parts[0]} {parts[1]} {rng.choice(PLACES)}",
+        ]))
+    return queries
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic book catalog.")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args(argv)
+    print(write_catalog(args.out or catalog_path("bench/data", args.count, args.seed), args.count, args.seed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""Benchmark and load-test suite.
+
+    python -m bench.run --sizes 1000,100000 --out bench/results/latest.json
+    python -m bench.run --sizes 1000 --concurrency 32 --baseline bench/results/previous.json
+
+Offline: for each synthetic catalog size, catalog load time and memory, TF-IDF fit
+time, service start-up and `_simple_recommend` / `recommend` latency percentiles.
+Each size runs in a fresh interpreter so memory figures do not leak between sizes.
+
+Load: starts the stub LLM (`bench.stub_llm`) and the API under uvicorn, then drives
+`/recommend`, `/conversations/message` and `/summaries` at the given concurrency.
+
+Everything is written to one JSON file; `--baseline` compares it with an earlier run.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from bench.catalog_gen import catalog_path, sample_queries, write_catalog
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, "bench", "data")
+DEFAULT_SIZES = "1000,100000"
+DEFAULT_QUERIES = 200
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p90/p99/max of `samples` (seconds), in milliseconds."""
+    if not samples:
+        return {"count": 0}
+    arr = np.asarray(samples) * 1000.0
+    return {
+        "count": len(samples),
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p90_ms": round(float(np.percentile(arr, 90)), 3),
+        "p99_ms": round(float(np.percentile(arr, 99)), 3),
+        "max_ms": round(float(arr.max()), 3),
+    }
+
+
+def _timed_memory(fn: Callable):
+    """Run `fn` and return (result, seconds, peak traced MiB)."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = fn()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, round(elapsed, 4), round(peak / 2 ** 20, 2)
+
+
+def _latencies(fn: Callable[[str], object], queries: List[str]) -> List[float]:
+    samples = []
+    for q in queries:
+        started = time.perf_counter()
+        fn(q)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+# ---------- Offline ----------
+def offline_size(size: int, n_queries: int, seed: int = 0) -> Dict:
+    """Benchmarks for one catalog size; meant to run in its own process."""
+    os.environ.pop("OPENAI_API_KEY", None)
+    from catalog import Catalog, iter_summaries
+    from conversation_store import InMemoryConversationStore
+    from keyword_index import KeywordIndex
+    from smart_librarian import SmartLibrarianService, load_summaries
+    from tfidf_index import HAS_SKLEARN, TfidfIndex
+
+    path = write_catalog(catalog_path(DATA_DIR, size, seed), size, seed)
+    report: Dict = {"size": size, "file_mib": round(os.path.getsize(path) / 2 ** 20, 2)}
+
+    summaries, secs, peak = _timed_memory(lambda: load_summaries(path))
+    report["load_summaries"] = {"seconds": secs, "peak_mib": peak}
+    del summaries
+    catalog, secs, peak = _timed_memory(lambda: Catalog.from_records(iter_summaries(path)))
+    report["catalog_load"] = {"seconds": secs, "peak_mib": peak, "resident_mib": round(catalog.nbytes() / 2 ** 20, 2)}
+
+    if HAS_SKLEARN:
+        started = time.perf_counter()
+        TfidfIndex.fit(catalog.corpus())
+        report["tfidf_fit_seconds"] = round(time.perf_counter() - started, 4)
+    started = time.perf_counter()
+    KeywordIndex.build(catalog.corpus())
+    report["bm25_build_seconds"] = round(time.perf_counter() - started, 4)
+    del catalog
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        service = SmartLibrarianService(
+            summaries_path=path,
+            conversation_store=InMemoryConversationStore(),
+            journal_path=os.path.join(tmp, "journal.jsonl"),
+            tfidf_path="",
+            full_summaries_path="",
+        )
+        report["service_init_seconds"] = round(time.perf_counter() - started, 4)
+        queries = sample_queries(n_queries)
+        report["simple_recommend"] = percentiles(_latencies(lambda q: service._simple_recommend(q, 3), queries))
+        service.invalidate_caches()
+        report["recommend_cold"] = percentiles(_latencies(lambda q: service.recommend(q, 3), queries))
+        report["recommend_warm"] = percentiles(_latencies(lambda q: service.recommend(q, 3), queries))
+        service.invalidate_caches()
+        started = time.perf_counter()
+        service.recommend_many(queries, 3)
+        report["recommend_many_seconds"] = round(time.perf_counter() - started, 4)
+    report["max_rss_mib"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return report
+
+
+def run_offline(sizes: List[int], n_queries: int, seed: int) -> Dict[str, Dict]:
+    results = {}
+    for size in sizes:
+        print(f"offline: {size} titles", file=sys.stderr, flush=True)
+        out = subprocess.run(
+            [sys.executable, "-m", "bench.run", "--offline-size", str(size), "--queries", str(n_queries),
+             "--seed", str(seed)],
+            cwd=ROOT, check=True, stdout=subprocess.PIPE,
+        )
+        results[str(size)] = json.loads(out.stdout)
+    return results
+
+
+# ---------- Load test ----------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(url: str, timeout: float, proc: subprocess.Popen) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} was not ready after {timeout}s")
+
+
+async def _drive(concurrency: int, total: int, make_request: Callable[[int], object]) -> Dict:
+    samples: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker(wid: int) -> None:
+        nonlocal errors
+        for _ in counter:
+            started = time.perf_counter()
+            try:
+                resp = await make_request(wid)
+                ok = resp.status_code < 400
+            except Exception:
+                ok = False
+            if ok:
+                samples.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return dict(percentiles(samples), errors=errors, seconds=round(elapsed, 3),
+                rps=round(len(samples) / elapsed, 1) if elapsed > 0 else 0.0)
+
+
+async def _load(base: str, concurrency: int, total: int, n_queries: int) -> Dict[str, Dict]:
+    import httpx
+
+    queries = sample_queries(n_queries, seed=2)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    results: Dict[str, Dict] = {}
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=120.0) as client:
+        n = iter(range(10 ** 9))
+
+        async def recommend(_wid: int):
+            return await client.post("/recommend", json={"query": queries[next(n) % len(queries)]})
+        results["recommend"] = await _drive(concurrency, total, recommend)
+
+        cursors = [None]
+
+        async def summaries(_wid: int):
+            cursor = cursors[-1]
+            resp = await client.get("/summaries", params={"limit": 100, **({"cursor": cursor} if cursor else {})})
+            if resp.status_code == 200:
+                cursors.append(resp.json().get("next_cursor"))
+            return resp
+        results["summaries"] = await _drive(concurrency, total, summaries)
+
+        conversations = []
+        for _ in range(concurrency):
+            conversations.append((await client.post("/conversations")).json()["conversation_id"])
+
+        async def message(wid: int):
+            return await client.post("/conversations/message", json={
+                "conversation_id": conversations[wid], "message": queries[next(n) % len(queries)],
+            })
+        results["conversations_message"] = await _drive(concurrency, total, message)
+    return results
+
+
+def run_load(args) -> Dict:
+    """Start the stub LLM and the API, drive the endpoints, then stop both."""
+    catalog = write_catalog(catalog_path(DATA_DIR, args.load_size, args.seed), args.load_size, args.seed)
+    tmp = tempfile.mkdtemp(prefix="bench-")
+    stub_port, api_port = _free_port(), _free_port()
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-bench",
+        OPENAI_BASE_URL=f"http://127.0.0.1:{stub_port}/v1",
+        SUMMARIES_PATH=catalog,
+        FULL_SUMMARIES_PATH="",
+        CHROMA_PATH=os.path.join(tmp, "chroma"),
+        TFIDF_PATH=os.path.join(tmp, "tfidf"),
+        CATALOG_JOURNAL=os.path.join(tmp, "journal.jsonl"),
+        CONVERSATION_STORE="memory",
+        RETRIEVAL_MODE=args.retrieval,
+        PYTHONPATH=ROOT,
+    )
+    procs: List[subprocess.Popen] = []
+    try:
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "bench.stub_llm", "--port", str(stub_port),
+             "--latency", str(args.llm_latency), "--jitter", str(args.llm_jitter)],
+            cwd=ROOT, env=env,
+        ))
+        _wait_ready(f"http://127.0.0.1:{stub_port}/docs", 30, procs[0])
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "api:app", "--port", str(api_port), "--workers", str(args.workers),
+             "--log-level", "warning"],
+            cwd=ROOT, env=env,
+        ))
+        _wait_ready(f"http://127.0.0.1:{api_port}/ready", args.startup_timeout, procs[1])
+        print(f"load: {args.requests} requests per endpoint at concurrency {args.concurrency}", file=sys.stderr, flush=True)
+        endpoints = asyncio.run(_load(f"http://127.0.0.1:{api_port}", args.concurrency, args.requests, args.queries))
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {
+        "catalog_size": args.load_size,
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "workers": args.workers,
+        "retrieval": args.retrieval,
+        "llm_latency": args.llm_latency,
+        "llm_jitter": args.llm_jitter,
+        "endpoints": endpoints,
+    }
+
+
+# ---------- Results ----------
+def _flatten(data: Dict, prefix: str = "") -> Dict[str, float]:
+    flat: Dict[str, float] = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = float(value)
+    return flat
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Metrics that got worse than `baseline` by more than `tolerance` (relative)."""
+    cur, base = _flatten(current.get("results", {})), _flatten(baseline.get("results", {}))
+    regressions = []
+    for key in sorted(cur.keys() & base.keys()):
+        old, new = base[key], cur[key]
+        if not old or key.endswith((".count", ".size", ".concurrency", ".requests", ".workers", "llm_latency", "llm_jitter")):
+            continue
+        change = (new - old) / old
+        # Throughput is better when higher; times, memory and errors when lower
+        worse = -change if key.endswith(".rps") else change
+        if worse > tolerance:
+            regressions.append(f"{key}: {old:g} -> {new:g} ({change:+.1%})")
+    return regressions
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run the Smart Librarian benchmarks.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated catalog sizes, e.g. 1000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-offline", action="store_true")
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--load-size", type=int, default=1000, help="catalog size served during the load test")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--retrieval", default="vector", choices=["vector", "hybrid"])
+    parser.add_argument("--llm-latency", type=float, default=0.1)
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--out", default=os.path.join("bench", "results", "latest.json"))
+    parser.add_argument("--baseline", default=None, help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    parser.add_argument("--offline-size", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.offline_size is not None:
+        print(json.dumps(offline_size(args.offline_size, args.queries, args.seed)))
+        return
+
+    results: Dict = {}
+    if not args.skip_offline:
+        results["offline"] = run_offline([int(s) for s in args.sizes.split(",") if s.strip()], args.queries, args.seed)
+    if not args.skip_load:
+        results["load"] = run_load(args)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k != "offline_size"},
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(args.out)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
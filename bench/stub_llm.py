@@ -0,0 +1,145 @@
+"""OpenAI-compatible stub server for benchmarks.
+
+    python -m bench.stub_llm --port 8765 --latency 0.2 --jitter 0.05
+
+Serves `/v1/chat/completions` (plain, JSON mode, tool calls and streaming) and
+`/v1/embeddings` (deterministic hashed vectors), sleeping `latency` +/- `jitter`
+seconds per call so the service can be load-tested without network or cost.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from typing import List, Optional
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+LATENCY = float(os.environ.get("STUB_LATENCY", "0.1"))
+JITTER = float(os.environ.get("STUB_JITTER", "0"))
+# Delay between streamed chunks
+CHUNK_DELAY = float(os.environ.get("STUB_CHUNK_DELAY", "0.005"))
+# Summary tool calls per response, one per candidate title (the model may ask for several at once)
+TOOL_CALLS = int(os.environ.get("STUB_TOOL_CALLS", "1"))
+EMBEDDING_DIM = 256
+
+app = FastAPI()
+
+
+async def _sleep() -> None:
+    delay = LATENCY + random.uniform(-JITTER, JITTER) if JITTER else LATENCY
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+def _embed(text: str) -> List[float]:
+    """Bag-of-words vector hashed into EMBEDDING_DIM buckets, so similar texts stay close."""
+    vec = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    for word in text.lower().split():
+        vec[int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=4).digest(), "little") % EMBEDDING_DIM] += 1
+    norm = float(np.linalg.norm(vec))
+    return (vec / norm if norm else vec).tolist()
+
+
+def _candidate_titles(messages: List[dict]) -> List[str]:
+    for m in messages:
+        content = m.get("content") or ""
+        if m.get("role") == "system" and "Title: " in content:
+            return [part.split("\n", 1)[0] for part in content.split("Title: ")[1:]]
+    return ["The Hobbit"]
+
+
+def _usage(messages: List[dict], completion: str) -> dict:
+    prompt_tokens = sum(len(str(m.get("content") or "")) for m in messages) // 4
+    completion_tokens = len(completion) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+@app.post("/v1/embeddings")
+async def embeddings(req: Request):
+    body = await req.json()
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    await _sleep()
+    return {
+        "object": "list",
+        "model": body.get("model", "stub"),
+        "data": [{"object": "embedding", "index": i, "embedding": _embed(str(t))} for i, t in enumerate(inputs)],
+        "usage": {"prompt_tokens": 0, "total_tokens": 0},
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(req: Request):
+    body = await req.json()
+    messages = body["messages"]
+    titles = _candidate_titles(messages)
+    title = titles[0]
+    await _sleep()
+    if body.get("response_format"):
+        message = {"role": "assistant", "content": json.dumps({"title": title, "reason": "Se potrivește cererii."})}
+    elif body.get("tools") and not any(m.get("role") == "tool" for m in messages):
+        message = {"role": "assistant", "content": None, "tool_calls": [{
+            "id": f"call_stub{i}", "type": "function",
+            "function": {"name": "get_summary_by_title", "arguments": json.dumps({"title": t})},
+        } for i, t in enumerate(titles[:max(1, TOOL_CALLS)])]}
+    else:
+        message = {"role": "assistant", "content": f"Îți recomand {title}. Este o alegere potrivită pentru ce cauți."}
+    usage = _usage(messages, message.get("content") or "")
+    if not body.get("stream"):
+        return {
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    def chunk(delta: dict, finish: Optional[str] = None, **extra) -> str:
+        data = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish}] if delta is not None else [],
+                **extra}
+        return f"data: {json.dumps(data)}\n\n"
+
+    async def stream():
+        if message.get("tool_calls"):
+            for i, call in enumerate(message["tool_calls"]):
+                yield chunk({"role": "assistant", "tool_calls": [{"index": i, "id": call["id"], "type": "function",
+                                                                  "function": {"name": call["function"]["name"], "arguments": ""}}]})
+                yield chunk({"tool_calls": [{"index": i, "function": {"arguments": call["function"]["arguments"]}}]})
+            yield chunk({}, "tool_calls")
+        else:
+            for word in message["content"].split(" "):
+                if CHUNK_DELAY > 0:
+                    await asyncio.sleep(CHUNK_DELAY)
+                yield chunk({"content": word + " "})
+            yield chunk({}, "stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield chunk(None, usage=usage)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    global LATENCY, JITTER, TOOL_CALLS
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run the stub OpenAI-compatible server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=LATENCY, help="seconds added to every call")
+    parser.add_argument("--jitter", type=float, default=JITTER, help="uniform +/- seconds around --latency")
+    parser.add_argument("--tool-calls", type=int, default=TOOL_CALLS, help="summary tool calls per response")
+    args = parser.parse_args(argv)
+    LATENCY, JITTER, TOOL_CALLS = args.latency, args.jitter, args.tool_calls
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
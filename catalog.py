@@ -0,0 +1,456 @@
+"""Streaming loader and compact in-memory store for the book catalog."""
+
+import hashlib
+import json
+import os
+import threading
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from response_cache import normalize_query
+
+TITLE_PREFIX = "## Title:"
+THEMES_PREFIX = "Themes:"
+
+# A fuzzy match must reach this Dice similarity over title trigrams (typos, missing words)...
+FUZZY_MIN_SCORE = 0.85
+# ...and beat the runner-up by this much, so near-miss titles of other books are not substituted
+FUZZY_MIN_MARGIN = 0.1
+# Shortest query accepted as the prefix of a single title ("harry potter")
+FUZZY_MIN_PREFIX = 4
+# Trigrams shared by more titles than this are too common to narrow the search
+FUZZY_MAX_POSTINGS = 50000
+
+
+def normalize_title(title: str) -> str:
+    """Case-, diacritics- and punctuation-insensitive form of a title (same fold as cache keys)."""
+    return normalize_query(title)
+
+
+def parse_themes(summary: str) -> List[str]:
+    """Themes listed after `Themes:` in a summary, e.g. `Themes: war, love.` -> ["war", "love"]."""
+    idx = (summary or "").rfind(THEMES_PREFIX)
+    if idx < 0:
+        return []
+    text = summary[idx + len(THEMES_PREFIX):].strip().rstrip(".")
+    return [theme.strip() for theme in text.split(",") if theme.strip()]
+
+
+def _trigrams(norm: str) -> List[str]:
+    padded = f"  {norm} "
+    return list({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+class TitleIndex:
+    """Trigram index over normalized titles for fuzzy and prefix lookups."""
+
+    def __init__(self):
+        self._postings: Dict[str, array] = {}
+        self._norms: Dict[int, str] = {}
+
+    def add(self, pos: int, norm: str) -> None:
+        self._norms[pos] = norm
+        for gram in _trigrams(norm):
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array("I")
+            postings.append(pos)
+
+    def remove(self, pos: int) -> None:
+        norm = self._norms.pop(pos, None)
+        if norm is None:
+            return
+        for gram in _trigrams(norm):
+            postings = self._postings.get(gram)
+            if postings is None:
+                continue
+            try:
+                postings.remove(pos)
+            except ValueError:
+                pass
+
+    def search(self, norm: str) -> Optional[int]:
+        """Position of the one title `norm` unambiguously refers to, or None.
+
+        Accepted are a whole-word prefix of exactly one title ("harry potter") or a title
+        with a trigram Dice score of at least FUZZY_MIN_SCORE that clearly beats every
+        other title. Near misses such as "Lord of the Flies" for "The Lord of the Rings"
+        or "1985" for "1984" are rejected.
+        """
+        grams = _trigrams(norm)
+        if not grams:
+            return None
+        hits: Dict[int, int] = {}
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is None or len(postings) > FUZZY_MAX_POSTINGS:
+                continue
+            for pos in postings:
+                hits[pos] = hits.get(pos, 0) + 1
+        if len(norm) >= FUZZY_MIN_PREFIX:
+            prefixed = [pos for pos in hits if (self._norms[pos] + " ").startswith(norm + " ")]
+            if len(prefixed) == 1:
+                return prefixed[0]
+            if prefixed:
+                return None
+        best, best_score, runner_up = None, 0.0, 0.0
+        for pos, common in hits.items():
+            score = 2.0 * common / (len(grams) + len(_trigrams(self._norms[pos])))
+            if score > best_score:
+                best, best_score, runner_up = pos, score, best_score
+            elif score > runner_up:
+                runner_up = score
+        if best_score < FUZZY_MIN_SCORE or best_score - runner_up < FUZZY_MIN_MARGIN:
+            return None
+        return best
+
+
+class BookRecord:
+    """A single catalog entry. Supports dict-style `get`/`[]` for older call sites.
+
+    `summary` is the short text used for retrieval; `full_summary` is the long text the
+    summary tool returns and falls back to `summary` when none was provided.
+    """
+
+    __slots__ = ("title", "summary", "full_summary")
+
+    def __init__(self, title: str, summary: str, full_summary: str = ""):
+        self.title = title
+        self.summary = summary
+        self.full_summary = full_summary or summary
+
+    def get(self, key: str, default=None):
+        if key in BookRecord.__slots__:
+            return getattr(self, key)
+        return default
+
+    def __getitem__(self, key: str) -> str:
+        if key not in BookRecord.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"title": self.title, "summary": self.summary}
+
+    def __repr__(self) -> str:
+        return f"BookRecord(title={self.title!r})"
+
+
+def _iter_markdown(f) -> Iterator[BookRecord]:
+    title: Optional[str] = None
+    parts: List[str] = []
+    for line in f:
+        line = line.strip()
+        if line.startswith(TITLE_PREFIX):
+            if title is not None:
+                yield BookRecord(title, " ".join(parts))
+            title = line[len(TITLE_PREFIX):].strip()
+            parts = []
+        elif line and title is not None:
+            parts.append(line)
+    if title is not None:
+        yield BookRecord(title, " ".join(parts))
+
+
+def _iter_jsonl(f) -> Iterator[BookRecord]:
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        obj = json.loads(line)
+        yield BookRecord(str(obj.get("title", "")), str(obj.get("summary", "")), str(obj.get("full_summary", "")))
+
+
+def iter_full_summaries(path: str) -> Iterator[Tuple[str, str]]:
+    """Yield (title, full_summary) pairs from a JSONL file; nothing if it does not exist."""
+    if not path or not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                obj = json.loads(line)
+                yield str(obj.get("title", "")), str(obj.get("full_summary", ""))
+
+
+def with_full_summaries(records: Iterable[BookRecord], path: str) -> Iterator[BookRecord]:
+    """Attach full summaries from `path` (matched on normalized title) to streamed records."""
+    extra = {normalize_title(title): text for title, text in iter_full_summaries(path)}
+    for rec in records:
+        text = extra.get(normalize_title(rec.title))
+        yield BookRecord(rec.title, rec.summary, text) if text else rec
+
+
+def iter_summaries(paths: Union[str, Iterable[str]]) -> Iterator[BookRecord]:
+    """Lazily yield records from one or more catalog files.
+
+    Files ending in `.jsonl` hold one `{"title", "summary", "full_summary"?}` object per line; anything
+    else is read as the `## Title:` markdown format of `data/book_summaries.txt`.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                yield from _iter_jsonl(f)
+            else:
+                yield from _iter_markdown(f)
+
+
+class Catalog:
+    """Array-backed record store addressed by stable integer positions.
+
+    All text lives in one UTF-8 buffer; the spans array holds four offsets per record (title
+    start, then the end of the title, summary and full summary), so a record costs a few
+    integers instead of a dict and three string objects. Records are materialized on access.
+    Updates append the new text and repoint the spans; removals leave a tombstone so
+    positions (and the index rows built from them) never shift. The buffer and spans are
+    held together in `_store` so `compact` can swap both with one assignment; readers
+    take the pair once and never see a new buffer with old offsets.
+
+    Titles are indexed by normalized form for O(1) lookups; a trigram index for fuzzy
+    lookups is built on first use.
+    """
+
+    __slots__ = ("_store", "_alive", "_live", "_by_title", "_fuzzy", "_fuzzy_lock")
+
+    def __init__(self):
+        self._store: Tuple[bytearray, array] = (bytearray(), array("Q"))
+        self._alive = bytearray()
+        self._live = 0
+        self._by_title: Dict[str, int] = {}
+        self._fuzzy: Optional[TitleIndex] = None
+        self._fuzzy_lock = threading.Lock()
+
+    @classmethod
+    def from_records(cls, records: Iterable[BookRecord]) -> "Catalog":
+        catalog = cls()
+        for rec in records:
+            catalog.append(rec.title, rec.summary, rec.full_summary)
+        return catalog
+
+    def _write(self, title: str, summary: str, full_summary: str) -> Tuple[int, int, int, int]:
+        buf = self._store[0]
+        start = len(buf)
+        buf += title.encode("utf-8")
+        title_end = len(buf)
+        buf += summary.encode("utf-8")
+        summary_end = len(buf)
+        if full_summary and full_summary != summary:
+            buf += full_summary.encode("utf-8")
+        return start, title_end, summary_end, len(buf)
+
+    def _index_title(self, pos: int, title: str) -> None:
+        norm = normalize_title(title)
+        self._by_title[norm] = pos
+        if self._fuzzy is not None:
+            self._fuzzy.add(pos, norm)
+
+    def _unindex_title(self, pos: int, title: str) -> None:
+        norm = normalize_title(title)
+        if self._by_title.get(norm) == pos:
+            del self._by_title[norm]
+        if self._fuzzy is not None:
+            self._fuzzy.remove(pos)
+
+    def append(self, title: str, summary: str, full_summary: str = "") -> int:
+        pos = len(self._alive)
+        self._store[1].extend(self._write(title, summary, full_summary))
+        self._alive.append(1)
+        self._live += 1
+        self._index_title(pos, title)
+        return pos
+
+    def update(self, pos: int, title: str, summary: str, full_summary: str = "") -> None:
+        self._unindex_title(pos, self.title(self._check(pos)))
+        self._store[1][4 * pos:4 * pos + 4] = array("Q", self._write(title, summary, full_summary))
+        self._index_title(pos, title)
+
+    def remove(self, pos: int) -> None:
+        self._unindex_title(pos, self.title(self._check(pos)))
+        self._alive[pos] = 0
+        self._live -= 1
+
+    def _check(self, pos: int) -> int:
+        if not 0 <= pos < len(self._alive) or not self._alive[pos]:
+            raise KeyError(pos)
+        return pos
+
+    def is_live(self, pos: int) -> bool:
+        return 0 <= pos < len(self._alive) and bool(self._alive[pos])
+
+    def position(self, title: str) -> Optional[int]:
+        """Position of the live record whose title matches ignoring case, accents and punctuation."""
+        return self._by_title.get(normalize_title(title))
+
+    def lookup(self, title: str) -> Optional[int]:
+        """Like `position`, falling back to an unambiguous prefix or close trigram match."""
+        norm = normalize_title(title)
+        pos = self._by_title.get(norm)
+        if pos is not None or not norm:
+            return pos
+        if self._fuzzy is None:
+            with self._fuzzy_lock:
+                if self._fuzzy is None:
+                    fuzzy = TitleIndex()
+                    for p in self.positions():
+                        fuzzy.add(p, normalize_title(self.title(p)))
+                    self._fuzzy = fuzzy
+        return self._fuzzy.search(norm)
+
+    def _text(self, pos: int, field: int) -> str:
+        """Text of field 0 (title), 1 (summary) or 2 (full summary) of record `pos`."""
+        buf, spans = self._store
+        i = 4 * pos + field
+        return buf[spans[i]:spans[i + 1]].decode("utf-8")
+
+    def title(self, pos: int) -> str:
+        return self._text(pos, 0)
+
+    def summary(self, pos: int) -> str:
+        return self._text(pos, 1)
+
+    def full_summary(self, pos: int) -> str:
+        """Full summary of the record, or its short summary if it has none."""
+        return self._text(pos, 2) or self.summary(pos)
+
+    def themes(self, pos: int) -> List[str]:
+        return parse_themes(self.summary(pos))
+
+    def record(self, pos: int) -> BookRecord:
+        return BookRecord(self.title(pos), self.summary(pos), self.full_summary(pos))
+
+    @property
+    def slots(self) -> int:
+        """Number of positions ever allocated, including removed records."""
+        return len(self._alive)
+
+    def __len__(self) -> int:
+        return self._live
+
+    def __getitem__(self, pos: int) -> BookRecord:
+        if pos < 0 or pos >= len(self._alive):
+            raise IndexError("catalog position out of range")
+        return self.record(self._check(pos))
+
+    def positions(self, start: int = 0) -> Iterator[int]:
+        """Live positions in ascending order, from `start` on."""
+        for pos in range(max(0, start), len(self._alive)):
+            if self._alive[pos]:
+                yield pos
+
+    def __iter__(self) -> Iterator[BookRecord]:
+        for pos in self.positions():
+            yield self.record(pos)
+
+    def titles(self) -> Iterator[str]:
+        for pos in self.positions():
+            yield self.title(pos)
+
+    def corpus(self) -> Iterator[str]:
+        """Yield one `title summary` document per position (empty for removed records),
+        so row i of an index built from it is position i."""
+        for pos in range(len(self._alive)):
+            yield f"{self.title(pos)} {self.summary(pos)}" if self._alive[pos] else ""
+
+    def compact(self) -> None:
+        """Drop text left behind by updates and removals; positions are unchanged."""
+        old_buf, old_spans = self._store
+        buf = bytearray()
+        spans = array("Q")
+        for pos in range(len(self._alive)):
+            if self._alive[pos]:
+                start, title_end, summary_end, end = old_spans[4 * pos:4 * pos + 4]
+                base = len(buf)
+                buf += old_buf[start:end]
+                spans.extend((base, base + title_end - start, base + summary_end - start, len(buf)))
+            else:
+                spans.extend((len(buf),) * 4)
+        self._store = (buf, spans)
+
+    def nbytes(self) -> int:
+        buf, spans = self._store
+        return len(buf) + spans.itemsize * len(spans) + len(self._alive)
+
+    def apply(self, op: Dict[str, str]) -> Tuple[int, Optional[BookRecord]]:
+        """Apply one journal operation (`add`, `update` or `remove`, addressed by title).
+
+        Returns the affected position and the record as it was before (None for `add`).
+        Raises KeyError for an unknown title and ValueError for a conflicting one.
+        """
+        kind = op.get("op")
+        title = (op.get("title") or "").strip()
+        if kind == "add":
+            if not normalize_title(title):
+                raise ValueError("Title is required")
+            if self.position(title) is not None:
+                raise ValueError(f"Book already exists: {title}")
+            return self.append(title, op.get("summary") or "", op.get("full_summary") or ""), None
+        pos = self.position(title)
+        if pos is None:
+            raise KeyError(title)
+        old = self[pos]
+        if kind == "update":
+            new_title = (op.get("new_title") or "").strip() or old.title
+            other = self.position(new_title)
+            if other is not None and other != pos:
+                raise ValueError(f"Book already exists: {new_title}")
+            summary = op.get("summary")
+            summary = old.summary if summary is None else summary
+            full_summary = op.get("full_summary")
+            if full_summary is None:
+                # Keep a separate full summary; otherwise it follows the short one
+                full_summary = old.full_summary if old.full_summary != old.summary else ""
+            self.update(pos, new_title, summary, full_summary)
+        elif kind == "remove":
+            self.remove(pos)
+        else:
+            raise ValueError(f"Unknown catalog operation: {kind}")
+        return pos, old
+
+
+def fingerprint_sources(paths: Union[str, Iterable[str]]) -> str:
+    """Hash of the catalog source files' bytes, used to tell whether saved indexes still match."""
+    if isinstance(paths, str):
+        paths = [paths]
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(os.path.basename(path).encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def fold_fingerprint(fingerprint: str, op: Dict[str, str]) -> str:
+    """Fingerprint of the catalog after applying `op` on top of `fingerprint`."""
+    payload = json.dumps(op, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{fingerprint}\n{payload}".encode("utf-8")).hexdigest()
+
+
+class CatalogJournal:
+    """Append-only JSONL log of catalog edits, replayed on top of the source files at start-up.
+
+    Edits therefore survive restarts without rewriting the source catalog, and record
+    positions stay identical from one start to the next.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+    def append(self, op: Dict[str, str]) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(op, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
@@ -0,0 +1,188 @@
+"""Token-budgeted prompt assembly for chat completions.
+
+The newest turns are kept verbatim while they fit the budget; older ones are compacted
+into one-line notes that form a rolling summary, cached per conversation so each turn
+is compacted only once. Candidate summaries already quoted in the history are replaced
+there by a short reference, so every summary is sent once.
+"""
+
+import hashlib
+import os
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from response_cache import ResponseCache
+
+# Prompt budget (system prompt, candidate context and history) in tokens
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3000"))
+# Cap on the rolling summary of compacted turns, and on each of its lines
+ROLLING_SUMMARY_TOKENS = int(os.environ.get("ROLLING_SUMMARY_TOKENS", "400"))
+COMPACT_LINE_TOKENS = 40
+# Summaries shorter than this are not worth replacing with a reference
+MIN_DEDUPE_CHARS = 80
+# Tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Savings are measured against the prompt sent before budgeting: the last this many turns verbatim
+NAIVE_HISTORY_TURNS = 10
+TIKTOKEN_ENCODING = os.environ.get("TIKTOKEN_ENCODING", "o200k_base")
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _tiktoken():
+    """The tiktoken encoding if tiktoken is installed, else None (a heuristic is used)."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+        except Exception:
+            _encoding = None
+        _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    enc = _tiktoken()
+    if enc is not None:
+        return len(enc.encode(text or "", disallowed_special=()))
+    # About four characters per token for English and Romanian prose
+    return (len(text or "") + 3) // 4
+
+
+def truncate_tokens(text: str, limit: int) -> str:
+    """`text` cut to at most `limit` tokens, with an ellipsis when shortened."""
+    if count_tokens(text) <= limit:
+        return text
+    enc = _tiktoken()
+    if enc is not None:
+        return enc.decode(enc.encode(text, disallowed_special=())[:max(0, limit - 1)]).rstrip() + "…"
+    return text[:max(0, limit * 4 - 1)].rstrip() + "…"
+
+
+def message_tokens(messages: Sequence[Dict]) -> int:
+    return sum(count_tokens(str(m.get("content") or "")) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def _turn_key(turn: Dict[str, str]) -> str:
+    h = hashlib.blake2b(digest_size=12)
+    h.update(turn["role"].encode("utf-8"))
+    h.update(b"\0")
+    h.update(turn["content"].encode("utf-8"))
+    return h.hexdigest()
+
+
+def _compact_turn(turn: Dict[str, str]) -> str:
+    # The first line carries the gist: the question, or the recommended title
+    first = turn["content"].strip().split("\n", 1)[0]
+    role = "Utilizator" if turn["role"] == "user" else "Asistent"
+    return f"- {role}: {truncate_tokens(first, COMPACT_LINE_TOKENS)}"
+
+
+class _RollingSummary:
+    __slots__ = ("keys", "lines", "tokens", "seen")
+
+    def __init__(self):
+        # Lines currently in the summary, oldest first
+        self.keys: List[str] = []
+        self.lines: List[str] = []
+        self.tokens: List[int] = []
+        # Every turn compacted so far, including those trimmed off, so none is compacted twice
+        self.seen: Set[str] = set()
+
+
+class ContextBuilder:
+    """Builds chat prompts that fit `budget` tokens and reports the tokens saved."""
+
+    def __init__(self, budget: int = CONTEXT_TOKEN_BUDGET, rolling_tokens: int = ROLLING_SUMMARY_TOKENS,
+                 max_conversations: int = 10000):
+        self.budget = budget
+        self.rolling_tokens = rolling_tokens
+        self._rolling = ResponseCache(max_conversations, ttl=0)
+
+    @staticmethod
+    def _dedupe(history: List[Dict[str, str]], candidates: List[Tuple[str, List[str]]]) -> List[Dict[str, str]]:
+        """Replace candidate summaries quoted in earlier turns with a reference to the context."""
+        out = []
+        for turn in history:
+            content = turn["content"]
+            for title, texts in candidates:
+                for text in texts:
+                    if len(text) >= MIN_DEDUPE_CHARS and text in content:
+                        content = content.replace(text, f"[rezumatul cărții „{title}” este în context]")
+            out.append({"role": turn["role"], "content": content})
+        return out
+
+    def _summary_lines(self, older: List[Dict[str, str]], recent: List[Dict[str, str]],
+                       conversation_id: Optional[str]) -> List[str]:
+        """Compacted lines for `older` turns, preceded by those of turns that left the window.
+
+        Lines are cached per conversation by turn content, so a turn is compacted once;
+        turns sent verbatim in `recent` are left out."""
+        state = self._rolling.get(conversation_id) if conversation_id else None
+        if state is None:
+            state = _RollingSummary()
+        for turn in older:
+            key = _turn_key(turn)
+            if key not in state.seen:
+                line = _compact_turn(turn)
+                state.keys.append(key)
+                state.lines.append(line)
+                state.tokens.append(count_tokens(line))
+                state.seen.add(key)
+        # Oldest notes go first once the summary outgrows its cap
+        while state.lines and sum(state.tokens) > self.rolling_tokens:
+            del state.keys[0], state.lines[0], state.tokens[0]
+        if conversation_id and state.keys:
+            self._rolling.put(conversation_id, state)
+        verbatim = {_turn_key(turn) for turn in recent}
+        return [line for key, line in zip(state.keys, state.lines) if key not in verbatim]
+
+    def build(self, system_prompt: str, candidates: List[Tuple[str, str]], history: List[Dict[str, str]],
+              conversation_id: Optional[str] = None,
+              quoted: Optional[Dict[str, List[str]]] = None) -> Tuple[List[Dict], Dict[str, int]]:
+        """Assemble [system, context?, rolling summary?, *recent turns] within the budget.
+
+        `candidates` are (title, summary) pairs for the context block; `quoted` maps a
+        candidate title to other texts of it (e.g. the full summary) that earlier replies
+        may contain. Returns the messages and {prompt_tokens, naive_tokens, saved_tokens}, where
+        `naive_tokens` is the size of the fixed NAIVE_HISTORY_TURNS prompt this replaces.
+        """
+        context_text = "\n\n".join(f"Title: {title}\nSummary: {summary}" for title, summary in candidates)
+        head: List[Dict] = [{"role": "system", "content": system_prompt}]
+        if candidates:
+            head.append({"role": "system", "content": f"Context (cărți candidate):\n{context_text}"})
+        naive_tokens = message_tokens(head) + message_tokens(history[-NAIVE_HISTORY_TURNS:])
+
+        texts = [(title, [summary] + list((quoted or {}).get(title, []))) for title, summary in candidates]
+        turns = self._dedupe(history, texts)
+        # The newest turn (the question being answered) is always sent
+        remaining = self.budget - message_tokens(head) - message_tokens(turns[-1:])
+        keep = 1 if turns else 0
+        has_summary = bool(conversation_id) and self._rolling.get(conversation_id) is not None
+        if has_summary or message_tokens(turns[:-1]) > remaining:
+            # Leave room for the rolling summary of whatever does not fit
+            remaining -= self.rolling_tokens + MESSAGE_OVERHEAD_TOKENS
+        for turn in reversed(turns[:-1]):
+            cost = message_tokens([turn])
+            if cost > remaining:
+                break
+            remaining -= cost
+            keep += 1
+        split = len(turns) - keep
+        messages = list(head)
+        # Compaction is keyed on the original turns so it is stable across requests
+        lines = self._summary_lines(history[:split], history[split:], conversation_id) if split or has_summary else []
+        if lines:
+            messages.append({
+                "role": "system",
+                "content": "Rezumatul conversației anterioare:\n" + "\n".join(lines),
+            })
+        messages.extend(turns[split:])
+        prompt_tokens = message_tokens(messages)
+        return messages, {
+            "prompt_tokens": prompt_tokens,
+            "naive_tokens": naive_tokens,
+            "saved_tokens": max(0, naive_tokens - prompt_tokens),
+        }
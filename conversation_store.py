@@ -0,0 +1,327 @@
+"""Conversation storage backends for SmartLibrarianService.
+
+`InMemoryConversationStore` keeps conversations in an LRU with idle TTL and is the
+default. `SQLiteConversationStore` persists them in a WAL-mode database so they
+survive restarts and are shared by every worker process pointing at the same file;
+its conversation locks are leases in that database, so they hold across workers too.
+Pick one with `CONVERSATION_STORE=memory` or `CONVERSATION_STORE=sqlite:<path>`.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+CONVERSATION_TTL = float(os.environ.get("CONVERSATION_TTL", str(7 * 24 * 3600)))
+CONVERSATION_MAX = int(os.environ.get("CONVERSATION_MAX", "10000"))
+# Per-conversation cap on stored turns; older turns are dropped first
+CONVERSATION_MAX_MESSAGES = int(os.environ.get("CONVERSATION_MAX_MESSAGES", "200"))
+# Seconds a worker may hold a conversation's SQLite lock; a lease left by a crashed worker
+# is taken over after this, so it must exceed the slowest chat turn
+CONVERSATION_LOCK_TTL = float(os.environ.get("CONVERSATION_LOCK_TTL", "180"))
+# Bounds of the backoff between attempts to take a lease held by another worker
+LOCK_RETRY_MIN = 0.01
+LOCK_RETRY_MAX = 0.25
+
+
+class ConversationStore(ABC):
+    """Append-only conversation log with per-conversation locks.
+
+    These locks only serialize messages handled by the current process; stores shared
+    by several workers extend them across processes (see `SQLiteConversationStore`).
+    """
+
+    def __init__(self):
+        self._locks_guard = threading.Lock()
+        self._thread_locks: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+        self._async_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    # ---------- Storage interface ----------
+    @abstractmethod
+    def create(self) -> str:
+        ...
+
+    @abstractmethod
+    def exists(self, cid: str) -> bool:
+        ...
+
+    @abstractmethod
+    def append(self, cid: str, messages: List[Dict[str, str]]) -> None:
+        """Append turns to an existing conversation and restart its idle TTL.
+        Raises KeyError if it does not exist."""
+
+    @abstractmethod
+    def messages(self, cid: str, last: Optional[int] = None) -> List[Dict[str, str]]:
+        """Return the conversation (or only its `last` turns); empty if unknown or expired."""
+
+    def __contains__(self, cid: str) -> bool:
+        return self.exists(cid)
+
+    # ---------- Locking ----------
+    @contextmanager
+    def lock(self, cid: str) -> Iterator[None]:
+        with self._locks_guard:
+            lock = self._thread_locks.get(cid)
+            if lock is None:
+                lock = threading.Lock()
+                self._thread_locks[cid] = lock
+        with lock:
+            yield
+
+    @asynccontextmanager
+    async def alock(self, cid: str) -> AsyncIterator[None]:
+        with self._locks_guard:
+            lock = self._async_locks.get(cid)
+            if lock is None:
+                lock = asyncio.Lock()
+                self._async_locks[cid] = lock
+        async with lock:
+            yield
+
+
+class InMemoryConversationStore(ConversationStore):
+    """Process-local store: LRU over conversations with an idle TTL."""
+
+    def __init__(self, max_conversations: int = CONVERSATION_MAX, ttl: float = CONVERSATION_TTL,
+                 max_messages: int = CONVERSATION_MAX_MESSAGES):
+        super().__init__()
+        self.max_conversations = max(1, max_conversations)
+        self.ttl = ttl
+        self.max_messages = max(1, max_messages)
+        self._data: "OrderedDict[str, List[Dict[str, str]]]" = OrderedDict()
+        self._touched: Dict[str, float] = {}
+        self._guard = threading.Lock()
+
+    def _live(self, cid: str, now: float) -> Optional[List[Dict[str, str]]]:
+        turns = self._data.get(cid)
+        if turns is None:
+            return None
+        if self.ttl > 0 and now - self._touched[cid] > self.ttl:
+            del self._data[cid]
+            del self._touched[cid]
+            return None
+        return turns
+
+    def _touch(self, cid: str, now: float) -> None:
+        self._data.move_to_end(cid)
+        self._touched[cid] = now
+        while len(self._data) > self.max_conversations:
+            old, _ = self._data.popitem(last=False)
+            del self._touched[old]
+
+    def create(self) -> str:
+        cid = str(uuid.uuid4())
+        with self._guard:
+            self._data[cid] = []
+            self._touch(cid, time.monotonic())
+        return cid
+
+    def exists(self, cid: str) -> bool:
+        with self._guard:
+            return self._live(cid, time.monotonic()) is not None
+
+    def append(self, cid: str, messages: List[Dict[str, str]]) -> None:
+        now = time.monotonic()
+        with self._guard:
+            turns = self._live(cid, now)
+            if turns is None:
+                raise KeyError("Conversation not found")
+            turns.extend({"role": m["role"], "content": m["content"]} for m in messages)
+            if len(turns) > self.max_messages:
+                del turns[:len(turns) - self.max_messages]
+            self._touch(cid, now)
+
+    def messages(self, cid: str, last: Optional[int] = None) -> List[Dict[str, str]]:
+        now = time.monotonic()
+        with self._guard:
+            turns = self._live(cid, now)
+            if turns is None:
+                return []
+            selected = turns[-last:] if last else turns
+            return [dict(m) for m in selected]
+
+
+class SQLiteConversationStore(ConversationStore):
+    """SQLite-backed store shared across processes; WAL mode lets readers run alongside a writer.
+
+    `lock`/`alock` also take a lease on the conversation in the `locks` table, so
+    messages to one conversation are serialized across every worker using the file.
+    A lease expires after `lock_ttl` seconds in case its holder died.
+    """
+
+    # Run the TTL purge roughly once every this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str, ttl: float = CONVERSATION_TTL, max_messages: int = CONVERSATION_MAX_MESSAGES,
+                 lock_ttl: float = CONVERSATION_LOCK_TTL):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.max_messages = max(1, max_messages)
+        self.lock_ttl = lock_ttl
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "id TEXT PRIMARY KEY, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, conversation_id TEXT NOT NULL, "
+                "role TEXT NOT NULL, content TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_conv ON messages (conversation_id, id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_updated ON conversations (updated_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS locks ("
+                "name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # A connection inherited from the parent of a forked worker must not be reused
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _alive_after(self) -> float:
+        return time.time() - self.ttl if self.ttl > 0 else 0.0
+
+    def create(self) -> str:
+        cid = str(uuid.uuid4())
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT INTO conversations (id, created_at, updated_at) VALUES (?, ?, ?)", (cid, now, now))
+        return cid
+
+    def exists(self, cid: str) -> bool:
+        row = self._conn().execute(
+            "SELECT 1 FROM conversations WHERE id = ? AND updated_at >= ?", (cid, self._alive_after())
+        ).fetchone()
+        return row is not None
+
+    def append(self, cid: str, messages: List[Dict[str, str]]) -> None:
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            updated = conn.execute(
+                "UPDATE conversations SET updated_at = ? WHERE id = ? AND updated_at >= ?",
+                (now, cid, self._alive_after()),
+            ).rowcount
+            if not updated:
+                raise KeyError("Conversation not found")
+            conn.executemany(
+                "INSERT INTO messages (conversation_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                [(cid, m["role"], m["content"], now) for m in messages],
+            )
+            conn.execute(
+                "DELETE FROM messages WHERE conversation_id = ? AND id <= ("
+                "SELECT id FROM messages WHERE conversation_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (cid, cid, self.max_messages),
+            )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def messages(self, cid: str, last: Optional[int] = None) -> List[Dict[str, str]]:
+        rows = self._conn().execute(
+            "SELECT role, content FROM ("
+            "SELECT m.id, m.role, m.content FROM messages m JOIN conversations c ON c.id = m.conversation_id "
+            "WHERE m.conversation_id = ? AND c.updated_at >= ? ORDER BY m.id DESC LIMIT ?"
+            ") ORDER BY id",
+            (cid, self._alive_after(), last if last else -1),
+        ).fetchall()
+        return [{"role": role, "content": content} for role, content in rows]
+
+    # ---------- Cross-process locking ----------
+    def _try_lease(self, cid: str, owner: str) -> bool:
+        """Take the lease on `cid` for `owner` unless another owner holds an unexpired one."""
+        conn = self._conn()
+        now = time.time()
+        # BEGIN IMMEDIATE takes the write lock up front, so the check and the claim are atomic
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT owner, expires_at FROM locks WHERE name = ?", (cid,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                conn.rollback()
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO locks (name, owner, expires_at) VALUES (?, ?, ?)",
+                (cid, owner, now + self.lock_ttl),
+            )
+            conn.commit()
+            return True
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def _release_lease(self, cid: str, owner: str) -> None:
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM locks WHERE name = ? AND owner = ?", (cid, owner))
+
+    @contextmanager
+    def lock(self, cid: str) -> Iterator[None]:
+        # Threads of this process queue on the local lock, so only one of them polls the lease
+        with super().lock(cid):
+            owner = str(uuid.uuid4())
+            delay = LOCK_RETRY_MIN
+            try:
+                while not self._try_lease(cid, owner):
+                    time.sleep(delay)
+                    delay = min(delay * 2, LOCK_RETRY_MAX)
+                yield
+            finally:
+                self._release_lease(cid, owner)
+
+    @asynccontextmanager
+    async def alock(self, cid: str) -> AsyncIterator[None]:
+        async with super().alock(cid):
+            owner = str(uuid.uuid4())
+            delay = LOCK_RETRY_MIN
+            try:
+                while not await asyncio.to_thread(self._try_lease, cid, owner):
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, LOCK_RETRY_MAX)
+                yield
+            finally:
+                # Also runs if cancelled mid-acquisition; only this owner's lease is deleted
+                await asyncio.to_thread(self._release_lease, cid, owner)
+
+    def purge_expired(self) -> int:
+        """Delete conversations idle for longer than the TTL. Returns how many were removed."""
+        if self.ttl <= 0:
+            return 0
+        conn = self._conn()
+        with conn:
+            expired = [r[0] for r in conn.execute(
+                "SELECT id FROM conversations WHERE updated_at < ?", (self._alive_after(),)
+            )]
+            conn.executemany("DELETE FROM messages WHERE conversation_id = ?", [(cid,) for cid in expired])
+            conn.executemany("DELETE FROM conversations WHERE id = ?", [(cid,) for cid in expired])
+            conn.execute("DELETE FROM locks WHERE expires_at < ?", (time.time(),))
+        return len(expired)
+
+
+def store_from_env() -> ConversationStore:
+    """Build the store selected by CONVERSATION_STORE (`memory` or `sqlite:<path>`)."""
+    spec = os.environ.get("CONVERSATION_STORE", "memory")
+    if spec.startswith("sqlite:"):
+        return SQLiteConversationStore(spec[len("sqlite:"):] or "data/conversations.db")
+    return InMemoryConversationStore()
@@ -0,0 +1,89 @@
+"""Placeholder SVG book covers, rendered once per (title, size) and kept in a bounded LRU."""
+
+import base64
+import hashlib
+import os
+from typing import Dict, Iterable, Optional, Tuple
+
+from response_cache import ResponseCache
+
+COVER_SIZE = 512
+COVER_MIN_SIZE = 64
+COVER_MAX_SIZE = 2048
+COVER_CACHE_SIZE = int(os.environ.get("COVER_CACHE_SIZE", "4096"))
+# Render covers for the whole catalog (up to the cache size) in the background at start-up
+COVER_PRERENDER = os.environ.get("COVER_PRERENDER", "").lower() in ("1", "true", "yes")
+# Covers depend only on title and size, so clients may keep them for a long time
+COVER_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def parse_size(size: Optional[str]) -> int:
+    """Cover edge in pixels from `512` or `512x512`, clamped to the supported range."""
+    try:
+        value = int(str(size).lower().split("x")[0]) if size else COVER_SIZE
+    except ValueError:
+        value = COVER_SIZE
+    return max(COVER_MIN_SIZE, min(value, COVER_MAX_SIZE))
+
+
+def render_cover_svg(title: str, size: int = COVER_SIZE) -> bytes:
+    """Square placeholder cover with the title centered, drawn at `size` pixels."""
+    scale = size / COVER_SIZE
+    margin = round(32 * scale)
+    svg = f"""
+    <svg xmlns='http://www.w3.org/2000/svg' width='{size}' height='{size}'>
+      <defs>
+        <linearGradient id='g' x1='0' y1='0' x2='1' y2='1'>
+          <stop offset='0%' stop-color='#0b0b0d'/>
+          <stop offset='100%' stop-color='#b91c1c'/>
+        </linearGradient>
+      </defs>
+      <rect width='100%' height='100%' fill='url(#g)' />
+      <rect x='{margin}' y='{margin}' width='{size - 2 * margin}' height='{size - 2 * margin}' rx='{round(16 * scale)}' ry='{round(16 * scale)}' fill='none' stroke='#dc2626' stroke-width='{max(1, round(4 * scale))}'/>
+      <text x='50%' y='50%' dominant-baseline='middle' text-anchor='middle' fill='#ffffff' font-size='{max(8, round(28 * scale))}' font-family='Arial'>
+        {_escape(title or "Book")}
+      </text>
+    </svg>
+    """.strip()
+    return svg.encode("utf-8")
+
+
+def to_data_url(svg: bytes) -> str:
+    return "data:image/svg+xml;base64," + base64.b64encode(svg).decode("ascii")
+
+
+class CoverCache:
+    """LRU of rendered covers keyed on (title, size), each with a strong ETag."""
+
+    def __init__(self, max_entries: int = COVER_CACHE_SIZE):
+        self._cache = ResponseCache(max_entries, ttl=0)
+
+    def get(self, title: str, size: int = COVER_SIZE) -> Tuple[bytes, str]:
+        """Return (svg bytes, ETag) for the cover, rendering it on a miss."""
+        key = (title, size)
+        cached = self._cache.get(key)
+        if cached is None:
+            svg = render_cover_svg(title, size)
+            cached = (svg, '"' + hashlib.blake2b(svg, digest_size=16).hexdigest() + '"')
+            self._cache.put(key, cached)
+        return cached
+
+    def data_url(self, title: str, size: int = COVER_SIZE) -> str:
+        return to_data_url(self.get(title, size)[0])
+
+    def prerender(self, titles: Iterable[str], size: int = COVER_SIZE) -> int:
+        """Render covers for `titles` until the cache is full. Returns how many were rendered."""
+        count = 0
+        for title in titles:
+            if count >= self._cache.max_entries:
+                break
+            self.get(title, size)
+            count += 1
+        return count
+
+    def stats(self) -> Dict[str, int]:
+        return self._cache.stats()
@@ -0,0 +1,170 @@
+"""Bulk ingestion of the book catalog into the persistent vector store.
+
+Run as an admin command to (re)load a large catalog:
+
+    python ingest.py --summaries data/book_summaries.txt --batch-size 256 --workers 4
+
+Entries are keyed by a content hash and written as soon as their batch is embedded,
+so an interrupted run resumes where it stopped: already stored ids are skipped.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_BATCH_SIZE = 128
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 3
+
+
+def summary_id(item: Dict[str, str]) -> str:
+    """Content hash of a summary entry; changes whenever its title or text changes."""
+    h = hashlib.sha256()
+    h.update(item.get("title", "").encode("utf-8"))
+    h.update(b"\0")
+    h.update(item.get("summary", "").encode("utf-8"))
+    return h.hexdigest()[:32]
+
+
+def _batches(items: List, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _embed_with_retry(embedding_fn, documents: List[str], retries: int) -> Tuple[List, int]:
+    """Embed one batch, retrying with exponential backoff. Returns (embeddings, calls made)."""
+    calls = 0
+    while True:
+        calls += 1
+        try:
+            return list(embedding_fn(documents)), calls
+        except Exception:
+            if calls > retries:
+                raise
+            time.sleep(min(2 ** (calls - 1), 30))
+
+
+def ingest_summaries(
+    collection,
+    summaries: Iterable,
+    embedding_fn: Callable,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_workers: int = DEFAULT_WORKERS,
+    retries: int = DEFAULT_RETRIES,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, float]:
+    """Sync `collection` with the `summaries` records using batched, concurrent embedding calls.
+
+    Missing entries are embedded `batch_size` at a time with at most `max_workers`
+    embedding requests in flight; each finished batch is upserted immediately from
+    the calling thread. Entries no longer in the catalog are deleted.
+    Returns a throughput report.
+    """
+    started = time.perf_counter()
+    batch_size = max(1, batch_size)
+    max_workers = max(1, max_workers)
+
+    wanted = {summary_id(item): item for item in summaries}
+    stored = set(collection.get(include=[]).get("ids", []))
+    stale = [sid for sid in stored if sid not in wanted]
+    for chunk in _batches(stale, batch_size):
+        collection.delete(ids=chunk)
+    pending = [(sid, item) for sid, item in wanted.items() if sid not in stored]
+
+    embedded = 0
+    embedding_calls = 0
+    batches = _batches(pending, batch_size)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        in_flight = {}
+
+        def submit_next() -> bool:
+            batch = next(batches, None)
+            if batch is None:
+                return False
+            docs = [item["summary"] for _, item in batch]
+            in_flight[pool.submit(_embed_with_retry, embedding_fn, docs, retries)] = batch
+            return True
+
+        for _ in range(max_workers):
+            if not submit_next():
+                break
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                batch = in_flight.pop(fut)
+                embeddings, calls = fut.result()
+                embedding_calls += calls
+                # upsert keeps concurrent workers syncing the same index idempotent
+                collection.upsert(
+                    ids=[sid for sid, _ in batch],
+                    documents=[item["summary"] for _, item in batch],
+                    metadatas=[{"title": item["title"]} for _, item in batch],
+                    embeddings=embeddings,
+                )
+                embedded += len(batch)
+                if on_progress:
+                    on_progress(embedded, len(pending))
+                submit_next()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "documents": len(wanted),
+        "embedded": embedded,
+        "skipped": len(wanted) - len(pending),
+        "deleted": len(stale),
+        "embedding_calls": embedding_calls,
+        "seconds": round(elapsed, 3),
+        "docs_per_sec": round(embedded / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from catalog import CatalogJournal
+    from smart_librarian import (
+        CATALOG_JOURNAL, CHROMA_HOST, CHROMA_PATH, FULL_SUMMARIES_PATH, SUMMARIES_PATH, load_catalog, mark_synced,
+        open_collection, vector_store_lock,
+    )
+
+    parser = argparse.ArgumentParser(description="Bulk-load the book catalog into the vector store.")
+    parser.add_argument("--summaries", nargs="+", default=SUMMARIES_PATH.split(os.pathsep),
+                        help="catalog source files (default: SUMMARIES_PATH)")
+    parser.add_argument("--journal", default=CATALOG_JOURNAL,
+                        help="edits made through /books, replayed over the sources (default: CATALOG_JOURNAL)")
+    parser.add_argument("--full-summaries", default=FULL_SUMMARIES_PATH)
+    parser.add_argument("--chroma-path", default=CHROMA_PATH)
+    parser.add_argument("--chroma-host", default=CHROMA_HOST,
+                        help="Chroma server to load instead of the embedded store (default: CHROMA_HOST)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES)
+    args = parser.parse_args(argv)
+
+    # The same catalog the service serves: stored ids missing from it are deleted
+    summaries, fingerprints, _ = load_catalog(args.summaries, args.full_summaries, CatalogJournal(args.journal))
+
+    def progress(done: int, total: int) -> None:
+        print(f"embedded {done}/{total}", flush=True)
+
+    # Running workers writing catalog edits wait for the lock meanwhile
+    with vector_store_lock(args.chroma_path):
+        collection, embedding_fn = open_collection(args.chroma_path, args.chroma_host)
+        report = ingest_summaries(
+            collection,
+            summaries,
+            embedding_fn,
+            batch_size=args.batch_size,
+            max_workers=args.workers,
+            retries=args.retries,
+            on_progress=progress,
+        )
+        # Workers started on this catalog find the store up to date and skip their sync
+        mark_synced(collection, fingerprints[-1])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
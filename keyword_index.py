@@ -0,0 +1,109 @@
+"""Inverted index with BM25 scoring that needs no scikit-learn, used when TF-IDF is unavailable."""
+
+import heapq
+import math
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from response_cache import normalize_query
+
+# Common English function words; dropped like TfidfVectorizer(stop_words='english') does
+STOP_WORDS = frozenset(
+    "a about after all also an and any are as at be been but by can could do does for from "
+    "had has have he her his how i if in into is it its me my no not of on or our she so "
+    "some than that the their them then there these they this those to too up us was we "
+    "were what when where which while who why will with would you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, accent-stripped word tokens without stop words."""
+    return [tok for tok in normalize_query(text).split() if tok not in STOP_WORDS]
+
+
+class KeywordIndex:
+    """Token -> postings index over documents numbered 0..N-1.
+
+    Postings are parallel arrays of doc ids and term frequencies, so the index stays
+    compact for large catalogs; a query only touches the postings of its own tokens.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._doc_len = array("I")
+        self._total_len = 0
+        self._live = 0
+
+    @classmethod
+    def build(cls, docs: Iterable[str], **kwargs) -> "KeywordIndex":
+        index = cls(**kwargs)
+        for text in docs:
+            index.add(text)
+        return index
+
+    def add(self, text: str, doc_id: Optional[int] = None) -> int:
+        """Index `text` as the next document, or as `doc_id` if that slot is empty. Returns its id."""
+        if doc_id is None or doc_id == len(self._doc_len):
+            doc_id = len(self._doc_len)
+            self._doc_len.append(0)
+        elif self._doc_len[doc_id]:
+            raise ValueError(f"Document {doc_id} is already indexed")
+        tokens = tokenize(text)
+        counts: Dict[str, int] = {}
+        for tok in tokens:
+            counts[tok] = counts.get(tok, 0) + 1
+        for tok, tf in counts.items():
+            postings = self._postings.get(tok)
+            if postings is None:
+                postings = self._postings[tok] = (array("I"), array("I"))
+            postings[0].append(doc_id)
+            postings[1].append(tf)
+        self._doc_len[doc_id] = len(tokens)
+        self._total_len += len(tokens)
+        if tokens:
+            self._live += 1
+        return doc_id
+
+    def remove(self, doc_id: int, text: str) -> None:
+        """Drop the postings of document `doc_id`, which was indexed from `text`."""
+        for tok in set(tokenize(text)):
+            postings = self._postings.get(tok)
+            if postings is None:
+                continue
+            docs, tfs = postings
+            try:
+                i = docs.index(doc_id)
+            except ValueError:
+                continue
+            del docs[i]
+            del tfs[i]
+            if not docs:
+                del self._postings[tok]
+        if self._doc_len[doc_id]:
+            self._live -= 1
+        self._total_len -= self._doc_len[doc_id]
+        self._doc_len[doc_id] = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[int, float]]:
+        """Return up to `k` (doc_id, score) pairs with the highest BM25 score, best first."""
+        n_docs = self._live
+        if not n_docs or k <= 0:
+            return []
+        avg_len = self._total_len / n_docs or 1.0
+        scores: Dict[int, float] = {}
+        for tok in set(tokenize(query)):
+            postings = self._postings.get(tok)
+            if postings is None:
+                continue
+            docs, tfs = postings
+            df = len(docs)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for doc_id, tf in zip(docs, tfs):
+                norm = self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
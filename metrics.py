@@ -0,0 +1,188 @@
+"""Dependency-free counters and latency histograms rendered in the Prometheus text format.
+
+`span(stage)` times a block into the `librarian_stage_seconds` histogram and, when a
+request opened a timing scope with `track_request()`, records it for a Server-Timing header.
+"""
+
+import bisect
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds (seconds) shared by every latency histogram
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: _LabelValues, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values: Dict[_LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, total in items:
+            lines.append(f"{self.name}{_labels(self.label_names, values)} {_number(total)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts with a trailing +Inf slot, [sum, count])
+        self._series: Dict[_LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0, 0])
+            series[0][idx] += 1
+            series[1][0] += value
+            series[1][1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((values, (list(counts), list(totals))) for values, (counts, totals) in self._series.items())
+        for values, (counts, (total, count)) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, values)} {int(count)}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("librarian_stage_seconds", "Time spent in each stage of a request.", ["stage"])
+HTTP_SECONDS = Histogram("librarian_http_request_seconds", "HTTP request latency.", ["method", "route", "status"])
+RETRIEVAL_TOTAL = Counter("librarian_retrieval_total", "Uncached recommend calls by retrieval path.", ["path"])
+CHAT_PATH_TOTAL = Counter("librarian_chat_path_total", "Answered chats by completion path.", ["path"])
+FALLBACK_TOTAL = Counter("librarian_fallback_total", "Degraded paths taken after an error or missing dependency.", ["reason"])
+ERRORS_TOTAL = Counter("librarian_errors_total", "Exceptions swallowed by a fallback, by stage and type.", ["stage", "type"])
+LLM_TOKENS_TOTAL = Counter("librarian_llm_tokens_total", "Tokens reported by the chat completion API.", ["model", "kind"])
+PROMPT_TOKENS_TOTAL = Counter("librarian_prompt_tokens_total",
+                              "Prompt tokens sent, and saved by history compaction, as counted locally.", ["kind"])
+
+REGISTRY = (STAGE_SECONDS, HTTP_SECONDS, RETRIEVAL_TOTAL, CHAT_PATH_TOTAL, FALLBACK_TOTAL, ERRORS_TOTAL, LLM_TOKENS_TOTAL,
+            PROMPT_TOKENS_TOTAL)
+
+# (stage, seconds) spans of the request being handled; None outside `track_request`
+_request_spans: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_spans", default=None)
+
+
+# [prompts built, prompt tokens, tokens saved] by the context builder for the request being handled
+_request_prompt: ContextVar[Optional[List[int]]] = ContextVar("request_prompt", default=None)
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+
+def record_error(stage: str, exc: BaseException) -> None:
+    ERRORS_TOTAL.inc(stage, type(exc).__name__)
+
+
+def record_usage(model: str, usage) -> None:
+    """Count prompt/completion tokens from a completion's `usage`, if the API returned one."""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = getattr(usage, kind, None)
+        if value:
+            LLM_TOKENS_TOTAL.inc(model, kind[:-len("_tokens")], amount=value)
+
+
+def record_context(prompt_tokens: int, saved_tokens: int) -> None:
+    PROMPT_TOKENS_TOTAL.inc("sent", amount=prompt_tokens)
+    if saved_tokens:
+        PROMPT_TOKENS_TOTAL.inc("saved", amount=saved_tokens)
+    totals = _request_prompt.get()
+    if totals is not None:
+        totals[0] += 1
+        totals[1] += prompt_tokens
+        totals[2] += saved_tokens
+
+
+def request_prompt_tokens() -> Optional[Tuple[int, int]]:
+    """(prompt tokens, tokens saved) of the prompts built for the current request, or None if none was."""
+    totals = _request_prompt.get()
+    return (totals[1], totals[2]) if totals and totals[0] else None
+
+
+@contextmanager
+def track_request() -> Iterator[List[Tuple[str, float]]]:
+    """Collect the spans and prompt sizes recorded while handling one request (including in
+    worker threads); see `request_prompt_tokens`."""
+    spans: List[Tuple[str, float]] = []
+    token = _request_spans.set(spans)
+    prompt_token = _request_prompt.set([0, 0, 0])
+    try:
+        yield spans
+    finally:
+        _request_prompt.reset(prompt_token)
+        _request_spans.reset(token)
+
+
+_TOKEN_RE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def server_timing(spans: List[Tuple[str, float]], total: float) -> str:
+    """Format spans as a Server-Timing header value; repeated stages are summed."""
+    merged: Dict[str, float] = {}
+    for stage, seconds in spans:
+        merged[stage] = merged.get(stage, 0.0) + seconds
+    merged["total"] = total
+    return ", ".join(f"{_TOKEN_RE.sub('_', stage)};dur={seconds * 1000:.1f}" for stage, seconds in merged.items())
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,124 @@
+"""In-process LRU/TTL cache with optional nearest-neighbour lookup on query embeddings."""
+
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_query(text: str) -> str:
+    """Case-, accent- and punctuation-insensitive form of a query used in cache keys."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(_WORD_RE.findall(text.casefold()))
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "embedding", "scope")
+
+    def __init__(self, value, expires_at: float, embedding: Optional[np.ndarray], scope: Hashable):
+        self.value = value
+        self.expires_at = expires_at
+        self.embedding = embedding
+        self.scope = scope
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with per-entry TTL.
+
+    Entries stored with an embedding can also be found by `get_similar`, which returns
+    the value of the most similar live entry in the same `scope` whose cosine
+    similarity reaches `similarity_threshold` (a threshold of 0 disables this).
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0, similarity_threshold: float = 0.0):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return self.ttl > 0 and entry.expires_at <= now
+
+    def get(self, key: Hashable):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry, now):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def get_similar(self, embedding: Optional[Sequence[float]], scope: Hashable = None):
+        """Return the value of the nearest cached entry above the threshold, else None."""
+        if embedding is None or self.similarity_threshold <= 0:
+            return None
+        query = _unit(embedding)
+        now = time.monotonic()
+        best_key, best_sim = None, self.similarity_threshold
+        with self._lock:
+            keys: List[Hashable] = []
+            vectors: List[np.ndarray] = []
+            for key, entry in self._entries.items():
+                if entry.embedding is None or entry.scope != scope or self._expired(entry, now):
+                    continue
+                if entry.embedding.shape != query.shape:
+                    continue
+                keys.append(key)
+                vectors.append(entry.embedding)
+            if vectors:
+                sims = np.vstack(vectors) @ query
+                idx = int(np.argmax(sims))
+                if sims[idx] >= best_sim:
+                    best_key, best_sim = keys[idx], float(sims[idx])
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            self.semantic_hits += 1
+            return self._entries[best_key].value
+
+    def put(self, key: Hashable, value, embedding: Optional[Sequence[float]] = None, scope: Hashable = None) -> None:
+        vec = _unit(embedding) if embedding is not None else None
+        with self._lock:
+            self._entries[key] = _Entry(value, time.monotonic() + self.ttl, vec, scope)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def _unit(vec: Sequence[float]) -> np.ndarray:
+    arr = np.asarray(vec, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(arr))
+    return arr / norm if norm else arr
@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+from catalog import Catalog, CatalogJournal, fingerprint_sources, fold_fingerprint, iter_summaries
+from smart_librarian import load_catalog
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def shipped():
+    return Catalog.from_records(iter_summaries([os.path.join(ROOT, "data", "book_summaries.txt")]))
+
+
+def _lookup_title(catalog, query):
+    pos = catalog.lookup(query)
+    return catalog.title(pos) if pos is not None else None
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("The Hobbit", "The Hobbit"),
+    ("the hobbit!", "The Hobbit"),
+    ("harry potter", "Harry Potter and the Sorcerer's Stone"),
+    ("Harry Poter and the Sorcerers Stone", "Harry Potter and the Sorcerer's Stone"),
+    ("To Kill a Mockingbrd", "To Kill a Mockingbird"),
+])
+def test_lookup_resolves_close_titles(shipped, query, expected):
+    assert _lookup_title(shipped, query) == expected
+
+
+@pytest.mark.parametrize("query", [
+    "Lord of the Flies",
+    "Harry Potter and the Chamber of Secrets",
+    "The Book of Dust",
+    "1985",
+    "lord",
+])
+def test_lookup_rejects_other_books(shipped, query):
+    assert _lookup_title(shipped, query) is None
+
+
+def test_prefix_shared_by_several_titles_is_ambiguous():
+    catalog = Catalog()
+    catalog.append("Dune", "Desert planet.")
+    catalog.append("Dune Messiah", "Sequel.")
+    catalog.append("Dune Children", "Another sequel.")
+    assert _lookup_title(catalog, "dune") == "Dune"
+    assert _lookup_title(catalog, "dune messiah") == "Dune Messiah"
+    catalog.remove(catalog.position("Dune"))
+    assert _lookup_title(catalog, "dune") is None
+
+
+def _write_sources(tmp_path):
+    path = tmp_path / "books.txt"
+    path.write_text(
+        "## Title: The Hobbit\nBilbo leaves the Shire.\nThemes: adventure, friendship.\n\n"
+        "## Title: Dune\nA desert planet.\nThemes: politics, ecology.\n",
+        encoding="utf-8",
+    )
+    return [str(path)]
+
+
+def test_apply_update_rename_and_remove():
+    catalog = Catalog()
+    hobbit = catalog.append("The Hobbit", "Bilbo leaves the Shire.", "Bilbo helps the dwarves reclaim Erebor.")
+    dune = catalog.append("Dune", "A desert planet.")
+
+    pos, old = catalog.apply({"op": "update", "title": "the hobbit", "summary": "A dragon hoard."})
+    assert (pos, old.summary) == (hobbit, "Bilbo leaves the Shire.")
+    assert catalog.summary(hobbit) == "A dragon hoard."
+    # A separate full summary survives an update of the short one
+    assert catalog.full_summary(hobbit) == "Bilbo helps the dwarves reclaim Erebor."
+
+    catalog.apply({"op": "update", "title": "The Hobbit", "new_title": "There and Back Again"})
+    assert catalog.position("The Hobbit") is None
+    assert catalog.position("there and back again") == hobbit
+    with pytest.raises(ValueError):
+        catalog.apply({"op": "update", "title": "Dune", "new_title": "There and Back Again"})
+
+    pos, old = catalog.apply({"op": "remove", "title": "Dune"})
+    assert (pos, old.title, old.summary) == (dune, "Dune", "A desert planet.")
+    assert not catalog.is_live(dune)
+    assert list(catalog.titles()) == ["There and Back Again"]
+    with pytest.raises(KeyError):
+        catalog.apply({"op": "remove", "title": "Dune"})
+
+    # Positions never shift, and compaction keeps them
+    added, _ = catalog.apply({"op": "add", "title": "Emma", "summary": "Matchmaking."})
+    assert added == 2
+    catalog.compact()
+    assert [catalog.title(p) for p in catalog.positions()] == ["There and Back Again", "Emma"]
+    assert catalog.full_summary(hobbit) == "Bilbo helps the dwarves reclaim Erebor."
+
+
+def test_journal_replay_restores_edits_and_fingerprints(tmp_path):
+    sources = _write_sources(tmp_path)
+    journal = CatalogJournal(str(tmp_path / "journal.jsonl"))
+    ops = [
+        {"op": "add", "title": "Emma", "summary": "Matchmaking."},
+        {"op": "update", "title": "Dune", "summary": "Spice and sandworms."},
+        {"op": "remove", "title": "The Hobbit"},
+        # No longer applies once the book is gone; replay skips it
+        {"op": "update", "title": "The Hobbit", "summary": "Gone."},
+    ]
+    for op in ops:
+        journal.append(op)
+
+    catalog, fingerprints, touched = load_catalog(sources, None, journal)
+    assert list(catalog.titles()) == ["Dune", "Emma"]
+    assert catalog.summary(catalog.position("Dune")) == "Spice and sandworms."
+    assert touched == [2, 1, 0, None]
+
+    expected = [fingerprint_sources(sources)]
+    for op in ops:
+        expected.append(fold_fingerprint(expected[-1], op))
+    assert fingerprints == expected
+    # Replaying again gives the same catalog and fingerprints
+    assert load_catalog(sources, None, journal)[1] == fingerprints
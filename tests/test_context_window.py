@@ -0,0 +1,71 @@
+import context_window
+from context_window import NAIVE_HISTORY_TURNS, ContextBuilder, message_tokens
+
+SYSTEM = "You are a librarian."
+SUMMARY = ("Bilbo Baggins joins a company of dwarves to reclaim their homeland from the dragon Smaug, "
+           "discovering courage along the way.")
+
+
+def _history(n, words=40, start=0):
+    turns = []
+    for i in range(start, start + n):
+        role = "user" if i % 2 == 0 else "assistant"
+        turns.append({"role": role, "content": f"message {i} " + " ".join(["word"] * words)})
+    return turns
+
+
+def test_short_history_is_sent_verbatim():
+    history = _history(3)
+    messages, report = ContextBuilder(budget=3000).build(SYSTEM, [("The Hobbit", SUMMARY)], history)
+    assert messages[2:] == history
+    assert report["prompt_tokens"] == message_tokens(messages)
+    assert report["saved_tokens"] == 0
+
+
+def test_long_history_fits_the_budget_with_a_rolling_summary():
+    builder = ContextBuilder(budget=400, rolling_tokens=120)
+    history = _history(30)
+    messages, report = builder.build(SYSTEM, [], history, conversation_id="c1")
+    assert report["prompt_tokens"] <= 400
+    assert report["saved_tokens"] == report["naive_tokens"] - report["prompt_tokens"] > 0
+    assert messages[1]["content"].startswith("Rezumatul conversației anterioare:")
+    # The question being answered is always the last message
+    assert messages[-1] == history[-1]
+    kept = messages[2:]
+    assert kept == history[-len(kept):]
+
+
+def test_turns_are_compacted_once(monkeypatch):
+    compacted = []
+    compact = context_window._compact_turn
+    monkeypatch.setattr(context_window, "_compact_turn", lambda turn: compacted.append(turn) or compact(turn))
+    builder = ContextBuilder(budget=400, rolling_tokens=120)
+    history = _history(30)
+    for start in (30, 32, 34):
+        history = history + _history(2, start=start)
+        builder.build(SYSTEM, [], history, conversation_id="c1")
+    assert compacted
+    assert len({turn["content"] for turn in compacted}) == len(compacted)
+
+
+def test_quoted_summaries_are_replaced_by_a_reference():
+    history = [
+        {"role": "user", "content": "Ce-mi recomanzi?"},
+        {"role": "assistant", "content": f"Îți recomand The Hobbit. {SUMMARY}"},
+        {"role": "user", "content": "Mai spune-mi ceva."},
+    ]
+    messages, report = ContextBuilder(budget=3000).build(SYSTEM, [("The Hobbit", SUMMARY)], history)
+    assert SUMMARY in messages[1]["content"]
+    assert SUMMARY not in messages[3]["content"]
+    assert "[rezumatul cărții „The Hobbit” este în context]" in messages[3]["content"]
+    assert report["saved_tokens"] > 0
+
+
+def test_savings_are_measured_against_the_last_ten_turns():
+    history = _history(30)
+    messages, report = ContextBuilder(budget=3000).build(SYSTEM, [], history)
+    head = [{"role": "system", "content": SYSTEM}]
+    assert report["naive_tokens"] == message_tokens(head + history[-NAIVE_HISTORY_TURNS:])
+    # All 30 turns fit the budget: a larger prompt than the old one saves nothing
+    assert messages[1:] == history
+    assert report["saved_tokens"] == 0
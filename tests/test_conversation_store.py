@@ -0,0 +1,136 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from conversation_store import InMemoryConversationStore, SQLiteConversationStore
+
+
+def _turns(n, start=0):
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"turn {i}"} for i in range(start, start + n)]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "sqlite":
+            return SQLiteConversationStore(str(tmp_path / "conversations.db"), **kwargs)
+        return InMemoryConversationStore(**kwargs)
+    return make
+
+
+def test_append_and_read_back(make_store):
+    store = make_store()
+    cid = store.create()
+    store.append(cid, _turns(3))
+    assert cid in store
+    assert store.messages(cid) == _turns(3)
+    assert store.messages(cid, last=2) == _turns(2, start=1)
+    assert store.messages("missing") == []
+    with pytest.raises(KeyError):
+        store.append("missing", _turns(1))
+
+
+def test_oldest_turns_are_trimmed(make_store):
+    store = make_store(max_messages=4)
+    cid = store.create()
+    store.append(cid, _turns(3))
+    store.append(cid, _turns(3, start=3))
+    assert store.messages(cid) == _turns(4, start=2)
+
+
+def test_idle_conversations_expire(make_store, monkeypatch):
+    store = make_store(ttl=60)
+    cid = store.create()
+    store.append(cid, _turns(1))
+    wall, clock = time.time() + 61, time.monotonic() + 61
+    monkeypatch.setattr(time, "time", lambda: wall)
+    monkeypatch.setattr(time, "monotonic", lambda: clock)
+    assert cid not in store
+    assert store.messages(cid) == []
+    with pytest.raises(KeyError):
+        store.append(cid, _turns(1))
+
+
+def test_sqlite_purge_removes_expired(tmp_path, monkeypatch):
+    store = SQLiteConversationStore(str(tmp_path / "conversations.db"), ttl=60)
+    stale = store.create()
+    store.append(stale, _turns(2))
+    later = time.time() + 61
+    monkeypatch.setattr(time, "time", lambda: later)
+    fresh = store.create()
+    assert store.purge_expired() == 1
+    assert fresh in store and stale not in store
+    # The store is shared through the file
+    assert fresh in SQLiteConversationStore(store.path, ttl=60)
+
+
+def test_reading_does_not_restart_the_ttl(make_store, monkeypatch):
+    store = make_store(ttl=60)
+    cid = store.create()
+    store.append(cid, _turns(1))
+    wall, clock = time.time() + 40, time.monotonic() + 40
+    monkeypatch.setattr(time, "time", lambda: wall)
+    monkeypatch.setattr(time, "monotonic", lambda: clock)
+    assert store.messages(cid) == _turns(1)
+    wall, clock = wall + 40, clock + 40
+    assert store.messages(cid) == []
+
+
+def test_sqlite_lease_is_shared_across_stores(tmp_path, monkeypatch):
+    # Two stores on one file stand in for two worker processes
+    path = str(tmp_path / "conversations.db")
+    first, second = SQLiteConversationStore(path), SQLiteConversationStore(path, lock_ttl=5)
+    assert first._try_lease("c1", "worker-1")
+    assert not second._try_lease("c1", "worker-2")
+    assert second._try_lease("c2", "worker-2")
+    first._release_lease("c1", "worker-1")
+    assert second._try_lease("c1", "worker-2")
+    # A lease left behind by a crashed worker is taken over once it expires
+    later = time.time() + 6
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert first._try_lease("c1", "worker-1")
+
+
+def test_sqlite_lock_serializes_across_stores(tmp_path):
+    path = str(tmp_path / "conversations.db")
+    stores = [SQLiteConversationStore(path) for _ in range(3)]
+    cid = stores[0].create()
+
+    def turn(store, n):
+        with store.lock(cid):
+            seen = len(store.messages(cid))
+            time.sleep(0.01)
+            store.append(cid, [{"role": "user", "content": f"{n}:{seen}"}])
+
+    threads = [threading.Thread(target=turn, args=(stores[i % 3], i)) for i in range(9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # Each turn saw every earlier one: none read the log while another was mid-turn
+    assert sorted(int(m["content"].split(":")[1]) for m in stores[0].messages(cid)) == list(range(9))
+
+
+def test_sqlite_alock_releases_when_cancelled(tmp_path):
+    store = SQLiteConversationStore(str(tmp_path / "conversations.db"))
+    cid = store.create()
+
+    async def scenario():
+        held = asyncio.Event()
+
+        async def holder():
+            async with store.alock(cid):
+                held.set()
+                await asyncio.sleep(10)
+
+        task = asyncio.create_task(holder())
+        await held.wait()
+        assert not store._try_lease(cid, "other")
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert store._try_lease(cid, "other")
+
+    asyncio.run(scenario())
@@ -0,0 +1,94 @@
+import pytest
+
+pytest.importorskip("sklearn")
+
+from conversation_store import InMemoryConversationStore
+from smart_librarian import SmartLibrarianService
+from tfidf_index import TfidfIndex
+
+BOOKS = (
+    ("The Hobbit", "Bilbo joins the dwarves to reclaim their treasure from the dragon Smaug."),
+    ("Dune", "Paul Atreides survives on the desert planet Arrakis among the Fremen."),
+    ("Emma", "A young woman plays matchmaker in an English village."),
+    ("Moby Dick", "Captain Ahab hunts the white whale across the ocean."),
+)
+QUERIES = ["dragon treasure", "desert planet", "whale hunt", "matchmaker village", "wizard school"]
+
+
+def _service(tmp_path):
+    source = tmp_path / "books.txt"
+    if not source.exists():
+        source.write_text(
+            "".join(f"## Title: {title}\n{summary}\nThemes: fiction.\n\n" for title, summary in BOOKS),
+            encoding="utf-8",
+        )
+    return SmartLibrarianService(
+        summaries_path=str(source),
+        journal_path=str(tmp_path / "journal.jsonl"),
+        tfidf_path=str(tmp_path / "tfidf"),
+        full_summaries_path="",
+        conversation_store=InMemoryConversationStore(),
+        lazy=True,
+    )
+
+
+def _refuse_fit(cls, docs):
+    raise AssertionError("the saved index should have been reused")
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = TfidfIndex.fit(f"{title} {summary}" for title, summary in BOOKS)
+    index.save(str(tmp_path), {"fingerprint": "abc", "journal_ops": 0})
+    loaded, meta = TfidfIndex.load(str(tmp_path))
+    assert meta["fingerprint"] == "abc" and meta["shape"] == list(index.base.shape)
+    assert loaded.top_k(QUERIES, 2) == index.top_k(QUERIES, 2)
+    assert TfidfIndex.load(str(tmp_path / "missing")) is None
+
+
+def test_overlay_rows_override_the_base(tmp_path):
+    index = TfidfIndex.fit(f"{title} {summary}" for title, summary in BOOKS)
+    index.set_row(1, None)
+    index.set_row(4, "The Hobbit dragon")
+    assert index.rows == 5
+    assert [pos for pos, _ in index.top_k(["desert planet"], 5)[0]] == []
+    assert index.top_k(["dragon"], 1)[0][0][0] in (0, 4)
+    with pytest.raises(ValueError):
+        index.save(str(tmp_path), {})
+
+
+@pytest.mark.parametrize("edits_before_save", [0, 2])
+def test_saved_index_replays_journaled_edits(tmp_path, monkeypatch, edits_before_save):
+    service = _service(tmp_path)
+    service.load_indexes()
+    edits = [
+        lambda s: s.add_book("Treasure Island", "Pirates search for buried treasure on an island."),
+        lambda s: s.update_book("Dune", summary="Sandworms and spice on a desert planet."),
+        lambda s: s.remove_book("Moby Dick"),
+        lambda s: s.update_book("Emma", new_title="Emma Woodhouse"),
+    ]
+    for edit in edits[:edits_before_save]:
+        edit(service)
+    if edits_before_save:
+        # Saves the index as of this point of the journal
+        service.reindex()
+    for edit in edits[edits_before_save:]:
+        edit(service)
+    expected = service._tfidf.top_k(QUERIES + ["pirates island", "sandworms"], 3)
+
+    monkeypatch.setattr(TfidfIndex, "fit", classmethod(_refuse_fit))
+    restarted = _service(tmp_path)
+    restarted.load_indexes()
+    assert restarted.catalog_fingerprint == service.catalog_fingerprint
+    assert restarted._tfidf.top_k(QUERIES + ["pirates island", "sandworms"], 3) == expected
+
+
+def test_changed_sources_force_a_refit(tmp_path):
+    service = _service(tmp_path)
+    service.load_indexes()
+    source = tmp_path / "books.txt"
+    source.write_text(source.read_text(encoding="utf-8") + "## Title: Beloved\nA haunted house.\nThemes: memory.\n",
+                      encoding="utf-8")
+    restarted = _service(tmp_path)
+    restarted.load_indexes()
+    assert restarted._tfidf.rows == len(BOOKS) + 1
+    assert restarted._tfidf.top_k(["haunted"], 1)[0][0][0] == len(BOOKS)
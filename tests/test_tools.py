@@ -0,0 +1,12 @@
+from catalog import Catalog
+import tools
+
+
+def test_summary_tool_names_the_matched_book():
+    catalog = Catalog()
+    catalog.append("The Lord of the Rings", "Frodo carries the ring.", "Frodo carries the ring to Mordor.")
+    tools.bind_catalog(catalog)
+    assert tools.get_summary_by_title("the lord of the ring") == (
+        "Titlu: The Lord of the Rings\nRezumat: Frodo carries the ring to Mordor."
+    )
+    assert tools.get_summary_by_title("Lord of the Flies") == tools.UNAVAILABLE_SUMMARY
@@ -0,0 +1,135 @@
+"""Persisted TF-IDF model whose document matrix is memory-mapped and updatable row by row."""
+
+import importlib.util
+import json
+import os
+import pickle
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+# Optional TF-IDF cosine similarity for local index search. scikit-learn and scipy are
+# slow to import, so they are only located here and imported on first use.
+HAS_SKLEARN = all(importlib.util.find_spec(name) is not None for name in ("sklearn", "scipy"))
+
+TFIDF_PATH = os.environ.get("TFIDF_PATH", "data/tfidf")
+# Max number of dense similarity cells (queries x documents) scored per block
+TFIDF_SCORE_BLOCK = int(os.environ.get("TFIDF_SCORE_BLOCK", str(1 << 22)))
+
+_ARRAYS = ("data", "indices", "indptr")
+
+
+class TfidfIndex:
+    """A fitted `TfidfVectorizer` plus one L2-normalized row per catalog position.
+
+    The fitted base matrix is read-only (memory-mapped when loaded from disk, so forked
+    or sibling workers share its pages). Added, changed and removed rows live in a small
+    overlay that overrides the base; they are vectorized with the existing vocabulary
+    until the next full refit.
+    """
+
+    def __init__(self, vectorizer, matrix):
+        self.vectorizer = vectorizer
+        self.base = matrix
+        self._overlay: Dict[int, object] = {}
+        # (overlay positions, overlay rows, total rows); replaced atomically so readers
+        # never observe a half-applied update
+        self._snapshot: Tuple[np.ndarray, Optional[object], int] = (
+            np.empty(0, dtype=np.int64), None, matrix.shape[0]
+        )
+
+    @classmethod
+    def fit(cls, docs: Iterable[str]) -> "TfidfIndex":
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        vectorizer = TfidfVectorizer(stop_words='english')
+        return cls(vectorizer, vectorizer.fit_transform(docs).tocsr())
+
+    @property
+    def rows(self) -> int:
+        return self._snapshot[2]
+
+    def set_row(self, pos: int, text: Optional[str]) -> None:
+        """Replace (or append, when `pos` is past the end) the row at `pos`; None clears it."""
+        from scipy import sparse
+
+        if text:
+            row = self.vectorizer.transform([text])
+        else:
+            row = sparse.csr_matrix((1, self.base.shape[1]))
+        self._overlay[pos] = row
+        ids = np.fromiter(sorted(self._overlay), dtype=np.int64, count=len(self._overlay))
+        rows = sparse.vstack([self._overlay[int(i)] for i in ids], format="csr")
+        self._snapshot = (ids, rows, max(self.base.shape[0], int(ids[-1]) + 1))
+
+    def top_k(self, queries: List[str], k: int) -> List[List[Tuple[int, float]]]:
+        """Top-k (position, cosine score) pairs with a positive score for each query.
+
+        Rows are L2-normalized, so one sparse product gives cosine similarities. Queries
+        are scored in blocks to bound the dense score array, and top-k uses argpartition
+        instead of a full sort.
+        """
+        ids, overlay, n_rows = self._snapshot
+        k = min(k, n_rows)
+        if k <= 0:
+            return [[] for _ in queries]
+        q_mat = self.vectorizer.transform(queries)
+        n_base = self.base.shape[0]
+        chunk = max(1, TFIDF_SCORE_BLOCK // n_rows)
+        results: List[List[Tuple[int, float]]] = []
+        for start in range(0, len(queries), chunk):
+            block = q_mat[start:start + chunk]
+            sims = np.zeros((block.shape[0], n_rows))
+            # Multiplying the CSR document rows directly avoids converting their transpose
+            # (a CSC view) back to CSR on every block
+            sims[:, :n_base] = (self.base @ block.T).T.toarray()
+            if overlay is not None:
+                sims[:, ids] = (overlay @ block.T).T.toarray()
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(sims, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            for row_idx, row_scores in zip(top, top_scores):
+                results.append([(int(i), float(sc)) for i, sc in zip(row_idx, row_scores) if sc > 0])
+        return results
+
+    # ---------- Persistence ----------
+    def save(self, path: str, meta: Dict) -> None:
+        """Write the vectorizer and base matrix; `meta.json` is written last and marks the set valid."""
+        if self._overlay:
+            raise ValueError("Only a freshly fitted index can be saved; reindex first")
+        os.makedirs(path, exist_ok=True)
+        suffix = f".tmp{os.getpid()}"
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        with open(os.path.join(path, "vectorizer.pkl" + suffix), "wb") as f:
+            pickle.dump(self.vectorizer, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(os.path.join(path, "vectorizer.pkl" + suffix), os.path.join(path, "vectorizer.pkl"))
+        for name in _ARRAYS:
+            tmp = os.path.join(path, f"{name}{suffix}.npy")
+            np.save(tmp, getattr(self.base, name))
+            os.replace(tmp, os.path.join(path, f"{name}.npy"))
+        meta = dict(meta, shape=list(self.base.shape))
+        with open(meta_path + suffix, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + suffix, meta_path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional[Tuple["TfidfIndex", Dict]]:
+        """Load a saved index with its matrix memory-mapped; None if absent or incomplete."""
+        from scipy import sparse
+
+        try:
+            with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(os.path.join(path, "vectorizer.pkl"), "rb") as f:
+                vectorizer = pickle.load(f)
+            data, indices, indptr = (
+                np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in _ARRAYS
+            )
+            matrix = sparse.csr_matrix((data, indices, indptr), shape=tuple(meta["shape"]), copy=False)
+        except (OSError, ValueError, KeyError, pickle.UnpicklingError):
+            return None
+        return cls(vectorizer, matrix), meta
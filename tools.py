@@ -1,59 +1,142 @@
-"""Tools for the Smart Librarian chatbot."""
-
-book_summaries_dict = {
-    "1984": (
-        "Romanul lui George Orwell descrie o societate distopică aflată sub controlul total al statului. "
-        "Oamenii sunt supravegheați constant de Big Brother, iar gândirea liberă este considerată crimă. "
-        "Winston Smith încearcă să reziste acestui regim opresiv în căutarea adevărului și libertății. "
-        "Este o poveste despre manipulare ideologică și pierderea identității."),
-    "The Hobbit": (
-        "Bilbo Baggins, un hobbit confortabil, este recrutat de un grup de pitici pentru a-și recupera comoara de la dragonul Smaug. "
-        "În timpul călătoriei, descoperă curajul și ingeniozitatea pe care nu știa că le are. "
-        "Întâlnește creaturi fantastice și își face prieteni loiali. "
-        "O aventură despre prietenie și maturizare."),
-    "The Lord of the Rings": (
-        "Saga lui Frodo Baggins și a tovarășilor săi în încercarea de a distruge Inelul Suprem. "
-        "Călătoria lor traversează peisaje grandioase și bătălii epice împotriva forțelor lui Sauron. "
-        "Povestea explorează tema sacrificiului și a puterii corupătoare. "
-        "Un roman monumental despre lupta dintre bine și rău."),
-    "Harry Potter and the Sorcerer's Stone": (
-        "Harry descoperă că este vrăjitor și intră în lumea magică la Hogwarts. "
-        "Își face prieteni apropiați, Ron și Hermione, și se confruntă cu primele încercări ale lui Voldemort. "
-        "Școala îi oferă un sentiment de apartenență pe care nu l-a avut niciodată. "
-        "Poveste despre curaj, prietenie și descoperirea de sine."),
-    "To Kill a Mockingbird": (
-        "Prin ochii lui Scout Finch, romanul examinează prejudecățile rasiale din sudul Statelor Unite. "
-        "Tatăl ei, avocatul Atticus, apără un om nevinovat acuzat pe nedrept. "
-        "Copiii învață lecții despre empatie și justiție. "
-        "Este o reflecție asupra moralității și compasiunii."),
-    "Pride and Prejudice": (
-        "Elizabeth Bennet se confruntă cu presiunile sociale ale epocii și cu propriile prejudecăți față de Mr. Darcy. "
-        "Întâlnirile și neînțelegerile lor dezvăluie diferențe de clasă și caracter. "
-        "Pe măsură ce se cunosc, descoperă respect și dragoste adevărată. "
-        "Un roman despre evoluție personală și relații sincere."),
-    "The Catcher in the Rye": (
-        "Holden Caulfield povestește rătăcirile sale prin New York după exmatriculare. "
-        "Este dezamăgit de falsitatea lumii adulte și tânjește după inocență. "
-        "Întâlnirile cu oameni diverși îi accentuează alienarea. "
-        "O explorare a anxietății adolescenței și a identității."),
-    "The Chronicles of Narnia": (
-        "Frații Pevensie descoperă regatul Narnia, unde leul Aslan luptă împotriva Vrăjitoarei Albe. "
-        "Copiii devin regi și regine și învață lecții despre curaj și credință. "
-        "Narnia este un loc al miracolelor și al aventurii. "
-        "Seria reflectă teme religioase și morale."),
-    "War and Peace": (
-        "Romanul urmărește viețile aristocraților ruși în perioada războaielor napoleoniene. "
-        "Personajele se confruntă cu dragostea, destinul și tragediile războiului. "
-        "Tolstoi combină istoria cu filozofia personală. "
-        "O frescă vastă a societății ruse."),
-    "The Book Thief": (
-        "Liesel Meminger fură cărți pentru a face față realităților dure ale Germaniei naziste. "
-        "Familia ei adoptivă ascunde un evreu în pivniță, riscând totul. "
-        "Narațiunea este condusă de Moarte, care observă umanitatea în vremuri întunecate. "
-        "Poveste despre puterea cuvintelor și curaj."),
-}
+"""Tools for the Smart Librarian chatbot.
 
+Tools are registered with `register_tool`; `tool_schemas()` is what the model is
+offered and `run_tool` executes one call by name.
+"""
 
+import inspect
+from typing import Callable, Dict, Iterable, List, Optional
+
+from catalog import Catalog, normalize_title
+
+UNAVAILABLE_SUMMARY = "Rezumat indisponibil pentru acest titlu."
+UNKNOWN_TOOL = "Instrument necunoscut."
+TOOL_FAILED = "Instrumentul nu a putut fi executat."
+# Titles returned by search_by_theme when the model does not ask for a number
+THEME_SEARCH_LIMIT = 5
+THEME_SEARCH_MAX = 20
+
+# Catalog the tools read from; set by the service at startup
+_catalog: Optional[Catalog] = None
+# Normalized theme -> catalog positions, supplied by the service's theme index
+_theme_positions: Optional[Callable[[str], Iterable[int]]] = None
+
+
+class Tool:
+    __slots__ = ("name", "description", "parameters", "fn", "title_arg")
+
+    def __init__(self, name: str, description: str, parameters: Dict, fn: Callable[..., str],
+                 title_arg: Optional[str] = None):
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+        self.fn = fn
+        # Argument naming the book a call is about; the chat reports it as the recommendation
+        self.title_arg = title_arg
+
+    def schema(self) -> Dict:
+        return {
+            "type": "function",
+            "function": {"name": self.name, "description": self.description, "parameters": self.parameters},
+        }
+
+
+_registry: Dict[str, Tool] = {}
+_schemas: List[Dict] = []
+
+
+def register_tool(name: str, description: str, parameters: Dict,
+                  title_arg: Optional[str] = None) -> Callable[[Callable[..., str]], Callable[..., str]]:
+    """Decorator adding a function to the tools offered to the model. It must return a string."""
+    def decorator(fn: Callable[..., str]) -> Callable[..., str]:
+        _registry[name] = Tool(name, description, parameters, fn, title_arg)
+        _schemas[:] = [tool.schema() for tool in _registry.values()]
+        return fn
+    return decorator
+
+
+def get_tool(name: str) -> Optional[Tool]:
+    return _registry.get(name)
+
+
+def tool_schemas() -> List[Dict]:
+    return _schemas
+
+
+def run_tool(name: str, args: Dict) -> str:
+    """Execute tool `name`; arguments it does not declare are dropped."""
+    tool = _registry.get(name)
+    if tool is None:
+        return UNKNOWN_TOOL
+    accepted = inspect.signature(tool.fn).parameters
+    return tool.fn(**{k: v for k, v in args.items() if k in accepted})
+
+
+def bind_catalog(catalog: Catalog, theme_positions: Optional[Callable[[str], Iterable[int]]] = None) -> None:
+    """Make `catalog` the source of truth for the tools.
+
+    `theme_positions` maps a normalized theme to catalog positions; without it
+    theme search scans the catalog."""
+    global _catalog, _theme_positions
+    _catalog = catalog
+    _theme_positions = theme_positions
+
+
+def find_book(title: str) -> Optional[int]:
+    """Catalog position of the book `title` names: exact, normalized or an unambiguous close match."""
+    if _catalog is None or not title:
+        return None
+    return _catalog.lookup(title)
+
+
+@register_tool(
+    "get_summary_by_title",
+    "Returnează rezumatul complet pentru un titlu exact de carte.",
+    {"type": "object", "properties": {"title": {"type": "string"}}, "required": ["title"]},
+    title_arg="title",
+)
 def get_summary_by_title(title: str) -> str:
-    """Returnează rezumatul complet pentru titlul dat."""
-    return book_summaries_dict.get(title, "Rezumat indisponibil pentru acest titlu.")
+    """Returnează rezumatul complet pentru titlul dat, precedat de titlul găsit în catalog."""
+    pos = find_book(title)
+    if pos is None:
+        return UNAVAILABLE_SUMMARY
+    # The matched title is stated so the model notices when it differs from the one it asked for
+    return f"Titlu: {_catalog.title(pos)}\nRezumat: {_catalog.full_summary(pos)}"
+
+
+@register_tool(
+    "search_by_theme",
+    "Caută în biblioteca locală cărți cu o anumită temă (de ex. friendship, magic, war). "
+    "Returnează câte un titlu pe linie, împreună cu temele lui.",
+    {
+        "type": "object",
+        "properties": {
+            "theme": {"type": "string"},
+            "limit": {"type": "integer", "minimum": 1, "maximum": THEME_SEARCH_MAX},
+        },
+        "required": ["theme"],
+    },
+)
+def search_by_theme(theme: str, limit: int = THEME_SEARCH_LIMIT) -> str:
+    """Titluri din catalog care au tema dată, câte unul pe linie."""
+    key = normalize_title(theme or "")
+    if _catalog is None or not key:
+        return "Nicio carte găsită."
+    try:
+        limit = max(1, min(int(limit), THEME_SEARCH_MAX))
+    except (TypeError, ValueError):
+        limit = THEME_SEARCH_LIMIT
+    if _theme_positions is not None:
+        positions = _theme_positions(key)
+    else:
+        positions = (pos for pos in _catalog.positions()
+                     if any(normalize_title(t) == key for t in _catalog.themes(pos)))
+    lines = []
+    for pos in positions:
+        # Skip books removed since the theme index was built
+        if not _catalog.is_live(pos):
+            continue
+        lines.append(f"{_catalog.title(pos)} (teme: {', '.join(_catalog.themes(pos))})")
+        if len(lines) >= limit:
+            break
+    return "\n".join(lines) if lines else f"Nicio carte cu tema „{theme}”."